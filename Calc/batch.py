@@ -0,0 +1,178 @@
+import sys,re,csv,time,argparse,itertools
+import engine
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+#Command line front end to the calculator engine for batch jobs.
+#
+#    python batch.py [file]             one expression per line
+#    python batch.py -e "a*b+c" [file]  one csv row per line, the header
+#                                       names the columns
+#
+#Input is read and results are written BATCH_ROWS lines at a time, so
+#memory does not grow with the input. With -e the expression is compiled
+#once and, when NumPy is installed, run once per batch on whole columns.
+#Lines of expressions are grouped by their shape with the numbers taken
+#out, e.g. '# * # + #', and each shape is compiled once and run like a -e
+#expression over its numbers. Rows that cannot be evaluated print nan.
+
+BATCH_ROWS = 65536
+PLACEHOLDER = re.compile(r'_\d+$')
+NUMBER = re.compile(r'(?<![\w.])(\d+\.?\d*(?:[eE][-+]?\d+)?|\.\d+(?:[eE][-+]?\d+)?)')
+
+shapes = engine.ExpressionCache()
+
+def format_value(value):
+
+    return engine.format_number(value)
+
+def shape_of(line):
+
+    #Returns the expression with its numbers replaced by the names _0, _1,
+    #... and the numbers, as in ('_0 * _1', ['2', '3'])
+    numbers = NUMBER.findall(line)
+    names = iter(range(0,len(numbers)))
+    shape = NUMBER.sub(lambda m: " _%d " % next(names),line)
+    return shape,numbers
+
+def evaluate_lines(lines, vectorize=True):
+
+    results = [""]*len(lines)
+    groups = {}
+    for n,line in enumerate(lines):
+        line = line.strip()
+        if line == "":
+            continue
+        shape,numbers = shape_of(line)
+        group = groups.get(shape)
+        if group is None:
+            group = groups[shape] = ([],[])
+        group[0].append(n)
+        group[1].append(numbers)
+
+    for shape,(positions,rows) in groups.items():
+        try:
+            expression = shapes.get(shape)
+        except ValueError:
+            for n in positions:
+                results[n] = "nan"
+            continue
+        index = placeholders(expression,shape,len(rows[0]))
+        if index is None:
+            #Names the user typed, which have no value here
+            for n in positions:
+                results[n] = "nan"
+            continue
+        if vectorize and numpy is not None:
+            values = evaluate_columns(expression,index,rows)
+        else:
+            values = evaluate_rows(expression,index,rows)
+        for n,value in zip(positions,values):
+            results[n] = value
+    return results
+
+def placeholders(expression, shape, count):
+
+    #(name, position) of each number's name, or None if the line had names
+    #of its own. Those are not _N, or if they are, add an _ to the shape.
+    index = []
+    for name in expression.names:
+        if not PLACEHOLDER.match(name) or int(name[1:]) >= count:
+            return None
+        index.append((name,int(name[1:])))
+    if shape.count("_") != count:
+        return None
+    return index
+
+def evaluate_rows(expression, index, rows):
+
+    results = []
+    for row in rows:
+        try:
+            variables = dict((name,float(row[i])) for name,i in index)
+            results.append(format_value(expression.evaluate(variables)))
+        except (ValueError,ArithmeticError,IndexError):
+            results.append("nan")
+    return results
+
+def evaluate_columns(expression, index, rows):
+
+    #Whole batch at once on NumPy arrays. Where that gives inf or nan the
+    #row is worked out again by evaluate_rows, so that an error such as 1/0
+    #prints nan either way, as without NumPy.
+    try:
+        table = numpy.array([[row[i] for name,i in index] for row in rows],
+                            dtype=float).reshape(len(rows),len(index))
+    except (ValueError,IndexError):
+        return evaluate_rows(expression,index,rows)
+    variables = dict((name,table[:,j]) for j,(name,i) in enumerate(index))
+    with numpy.errstate(all='ignore'):
+        try:
+            result = expression.evaluate(variables)
+        except (ValueError,ArithmeticError,TypeError):
+            return evaluate_rows(expression,index,rows)
+    result = numpy.broadcast_to(numpy.asarray(result,dtype=float),(len(rows),))
+    values = [format_value(value) for value in result.tolist()]
+    for n in numpy.flatnonzero(~numpy.isfinite(result)).tolist():
+        values[n] = evaluate_rows(expression,index,[rows[n]])[0]
+    return values
+
+def run(args, source, stdout):
+
+    count = 0
+    start = time.time()
+    vectorize = numpy is not None and not args.no_numpy
+    if args.expression is None:
+        while True:
+            lines = list(itertools.islice(source,BATCH_ROWS))
+            if not lines:
+                break
+            stdout.write("\n".join(evaluate_lines(lines,vectorize)) + "\n")
+            count += len(lines)
+    else:
+        expression = engine.compile_expression(args.expression)
+        reader = csv.reader(source,delimiter=args.delimiter)
+        header = [name.strip() for name in next(reader)]
+        missing = [name for name in expression.names if name not in header]
+        if missing:
+            raise engine.CalcError("no column named %s" % ", ".join(missing))
+        index = [(name,header.index(name)) for name in expression.names]
+        evaluate = evaluate_rows
+        if vectorize:
+            evaluate = evaluate_columns
+        while True:
+            rows = list(itertools.islice(reader,BATCH_ROWS))
+            if not rows:
+                break
+            stdout.write("\n".join(evaluate(expression,index,rows)) + "\n")
+            count += len(rows)
+    stdout.flush()
+    elapsed = time.time() - start
+    if args.stats:
+        sys.stderr.write("%d rows in %.3f s, %.3f M rows/s\n" %
+                         (count,elapsed,count/max(elapsed,1e-9)/1e6))
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description="Evaluate expressions in bulk")
+    parser.add_argument("file",nargs="?",help="input file, stdin if omitted")
+    parser.add_argument("-e","--expression",
+                        help="expression over the csv columns of the input")
+    parser.add_argument("-d","--delimiter",default=",")
+    parser.add_argument("--no-numpy",action="store_true",
+                        help="evaluate row by row even if NumPy is installed")
+    parser.add_argument("--stats",action="store_true",
+                        help="print rows per second to stderr")
+    args = parser.parse_args()
+    try:
+        if args.file:
+            with open(args.file) as f:
+                run(args,f,sys.stdout)
+        else:
+            run(args,sys.stdin,sys.stdout)
+    except engine.CalcError as e:
+        sys.stderr.write("error: %s\n" % e)
+        sys.exit(1)
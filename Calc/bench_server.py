@@ -0,0 +1,84 @@
+import os,sys,time,argparse,asyncio,subprocess,tempfile
+
+#Load generator for server.py. Opens --connections clients that each send
+#--requests expressions one after the other, then prints requests per
+#second and latency percentiles. Without --unix or --port it starts its
+#own server on a temporary unix socket.
+#Usage: python bench_server.py [--connections 50] [--requests 2000] [--mix]
+
+SIMPLE = ["2*(3+4)-5/7","1+2+3+4+5+6+7+8+9","(1.5+2.25)*4^2","-3!+10"]
+#--mix adds a share of big number requests, which go to the process pool
+HEAVY = ["exact:3^20000","exact:2000!"]
+
+def percentile(values, p):
+
+    values = sorted(values)
+    return values[min(int(len(values) * p),len(values) - 1)]
+
+async def client(connect, requests, mix, latencies, errors):
+
+    reader,writer = await connect()
+    for i in range(requests):
+        if mix and i % 50 == 49:
+            source = HEAVY[i % len(HEAVY)]
+        else:
+            #Different numbers so that not every request is a cache hit
+            source = SIMPLE[i % len(SIMPLE)] + "+%d" % (i % 100)
+        start = time.perf_counter()
+        writer.write((source + "\n").encode())
+        reply = await reader.readline()
+        latencies.append(time.perf_counter() - start)
+        if not reply.startswith(b"ok "):
+            errors.append(reply)
+    writer.close()
+
+async def run(args, connect):
+
+    latencies = []
+    errors = []
+    start = time.perf_counter()
+    await asyncio.gather(*[client(connect,args.requests,args.mix,latencies,
+                                  errors)
+                           for i in range(args.connections)])
+    elapsed = time.perf_counter() - start
+    print("%d connections x %d requests%s" %
+          (args.connections,args.requests," with big numbers" if args.mix else ""))
+    print("    %.0f requests/s, p50 %.2f ms, p99 %.2f ms, max %.2f ms, %d errors" %
+          (len(latencies) / elapsed,percentile(latencies,0.5) * 1e3,
+           percentile(latencies,0.99) * 1e3,max(latencies) * 1e3,len(errors)))
+
+def main():
+
+    parser = argparse.ArgumentParser(description="Load test the Calc server")
+    parser.add_argument("--connections",type=int,default=50)
+    parser.add_argument("--requests",type=int,default=2000)
+    parser.add_argument("--mix",action="store_true")
+    parser.add_argument("--unix",metavar="PATH")
+    parser.add_argument("--host",default="127.0.0.1")
+    parser.add_argument("--port",type=int)
+    args = parser.parse_args()
+
+    server = None
+    path = args.unix
+    if path is None and args.port is None:
+        path = os.path.join(tempfile.mkdtemp(),"calc.sock")
+        here = os.path.dirname(os.path.abspath(__file__))
+        server = subprocess.Popen([sys.executable,os.path.join(here,"server.py"),
+                                   "--unix",path])
+        while not os.path.exists(path):
+            time.sleep(0.05)
+
+    if path is not None:
+        connect = lambda: asyncio.open_unix_connection(path)
+    else:
+        connect = lambda: asyncio.open_connection(args.host,args.port)
+    try:
+        asyncio.run(run(args,connect))
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+
+if __name__ == '__main__':
+
+    main()
@@ -1,7 +1,15 @@
 from kivy.uix.boxlayout import *
 from kivy.uix.textinput import *
+from kivy.uix.popup import Popup
 from kivy.app import App
 from kivy.properties import *
+import engine,exact
+from graph import GraphView
+
+#Results longer than this are shown a window at a time; the mouse wheel
+#over the input moves the window
+DISPLAY_CHARS = 2048
+PREVIEW_CHARS = 64
 
 class calcApp(App):
 
@@ -23,89 +31,159 @@ class MainWindow(BoxLayout):
     button_divide = ObjectProperty()
     button_equal_to = ObjectProperty()
     button_decimal = ObjectProperty()
+    preview = ObjectProperty()
+    exact = BooleanProperty(False)
     
     def __init__(self,**kwargs):
             
         super(MainWindow,self).__init__()
-        self.num1 = None
-        self.operation = None
-        self.num2 = None        
+        self.answer = None
+        self.digits = None
+        self.offset = 0
+        self.shown = None
+        self.evaluator = None
+        #Text, value and digits of the last preview of a whole expression
+        self.previewed = None
         
+    def expression_text(self):
+
+        #A long answer still on display stands for itself as ans
+        if self.shown is not None and self.textInput.text == self.shown:
+            return "ans"
+        return self.textInput.text
+
     def on_button_press(self, *args):
 
-        self.textInput.text += args[0]
+        if self.expression_text() == "ans":
+            self.textInput.text = "ans"
+            self.shown = None
+        self.textInput.do_cursor_movement('cursor_end')
+        self.textInput.insert_text(args[0])
 
-    def divide(self, *args):
+    def on_exact(self, *args):
+
+        self.evaluator = None
+        self.update_preview()
+
+    def update_preview(self, *args):
 
+        #Result so far, updated on every change of the input. The evaluator
+        #only redoes the part of the text that changed, and in exact mode
+        #refuses results too long to work out between two keystrokes.
+        if self.preview is None:
+            return
+        self.previewed = None
+        source = self.expression_text()
         try:
-            if self.num1 != None:
-                self.equal()
-                
-            self.num1 = float(self.textInput.text)
-            self.operation = '/'
-            self.textInput.text = ""
-        except ValueError:
-            pass
+            if self.evaluator is None:
+                arithmetic = exact.PREVIEW if self.exact else engine.FLOAT
+                self.evaluator = engine.IncrementalEvaluator(self.variables(),
+                                                             arithmetic)
+            self.evaluator.update(source)
+            value = self.evaluator.value()
+            digits = exact.Digits(value)
+            text = digits.text(0,PREVIEW_CHARS)
+            if len(digits) > PREVIEW_CHARS:
+                text += u"\u2026"
+            if self.evaluator.complete():
+                self.previewed = (source,value,digits)
+        except (ValueError,ArithmeticError):
+            text = ""
+        self.preview.text = text
+
+    def divide(self, *args):
+
+        self.on_button_press('/')
         
     def minus(self, *args):
 
-        try:
-            if self.num1 != None:
-                self.equal()
-
-            self.num1 = float(self.textInput.text)
-            self.operation = '-'
-            self.textInput.text = ""
-        except ValueError:
-            pass
+        self.on_button_press('-')
 
     def multiply(self, *args):
 
-        try:            
-            if self.num1 != None:
-                self.equal()
-
-            self.num1 = float(self.textInput.text)
-            self.operation = '*'
-            self.textInput.text = ""
-        except ValueError:
-            pass
+        self.on_button_press('*')
         
     def decimal(self, *args):
 
-        if self.textInput.text.find('.')!=-1:
-            self.textInput.text += '.'
+        self.on_button_press('.')
 
     def plus(self, *args):
 
-        try:
-            if self.num1 != None:
-                self.equal()
+        self.on_button_press('+')
 
-            self.num1 = float(self.textInput.text)
-            self.operation = '+'
-            self.textInput.text = ""
-        except ValueError:
-            pass
+    def clear(self, *args):
+
+        self.textInput.text = ""
+        self.shown = None
+
+    def arithmetic(self):
+
+        return exact.EXACT if self.exact else engine.FLOAT
+
+    def variables(self):
+
+        if self.answer is None:
+            return {}
+        if not self.exact:
+            return {'ans': float(self.answer)}
+        return {'ans': self.answer}
 
     def equal(self, *args):
 
-        try:            
-            self.num2 = float(self.textInput.text)
-            if self.operation == '+':
-                self.textInput.text = str(self.num2+self.num1)
-                self.num1 = None
-            elif self.operation == '*':
-                self.textInput.text = str(self.num2*self.num1)
-                self.num1 = None
-            elif self.operation == '-':
-                self.textInput.text = str(self.num2-self.num1)
-                self.num1 = None
-            elif self.operation == '/':
-                self.textInput.text = str(self.num2/self.num1)
-                self.num1 = None
+        source = self.expression_text()
+        if self.previewed is not None and self.previewed[0] == source:
+            result,digits = self.previewed[1:]
+        else:
+            try:
+                result = engine.evaluate(source,self.variables(),
+                                         self.arithmetic())
+                digits = exact.Digits(result)
+            except (ValueError,ArithmeticError) as e:
+                self.preview.text = engine.error_message(e)
+                return
+        self.answer = result
+        self.digits = digits
+        self.evaluator = None
+        self.previewed = None
+        self.show_answer(0)
+
+    def plot(self, *args):
+
+        #Graph of y = f(x) for the expression in x typed in the input
+        source = self.textInput.text
+        try:
+            view = GraphView(source)
         except ValueError:
-            pass
+            return
+        Popup(title="y = " + source,content=view,size_hint=(0.9,0.9)).open()
+
+    def show_answer(self, offset):
+
+        length = len(self.digits)
+        if length <= DISPLAY_CHARS:
+            self.textInput.text = self.digits.text(0,length)
+            self.shown = None
+            return
+        self.offset = max(0,min(offset,length - DISPLAY_CHARS))
+        text = self.digits.text(self.offset,self.offset + DISPLAY_CHARS)
+        if self.offset > 0:
+            text = u"\u2026" + text
+        if self.offset + DISPLAY_CHARS < length:
+            text += u"\u2026 (%d digits)" % length
+        self.shown = text
+        self.textInput.text = text
+
+    def on_touch_down(self, touch):
+
+        if (self.shown is not None and self.textInput.text == self.shown and
+                touch.is_mouse_scrolling and
+                self.textInput.collide_point(*touch.pos)):
+            step = DISPLAY_CHARS // 2
+            if touch.button == 'scrollup':
+                step = -step
+            self.show_answer(self.offset + step)
+            return True
+        return super(MainWindow,self).on_touch_down(touch)
     
 if __name__ == '__main__':    
         
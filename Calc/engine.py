@@ -0,0 +1,482 @@
+import re,math,bisect,decimal,operator
+from collections import OrderedDict
+
+#Expression engine behind the calculator. Text is tokenized, parsed with
+#the usual precedence (unary minus, ^ binding right, then * /, then + -)
+#and compiled to a short postfix program. Compiled programs are kept in an
+#LRU keyed by the text, so evaluating the same expression again skips
+#straight to running it. What the numbers are is up to an arithmetic
+#object, floats by default, see exact.py for the exact one. Nothing here
+#depends on Kivy.
+
+CACHE_SIZE = 256
+
+TOKEN = re.compile(r'\s*(?:(\d+\.?\d*(?:[eE][-+]?\d+)?|\.\d+(?:[eE][-+]?\d+)?)'
+                   r'|([A-Za-z_]\w*)|(\*\*|[-+*/^()!]))')
+SPACE = re.compile(r'\s*')
+
+#Opcodes of the compiled program
+PUSH = 0
+LOAD = 1
+NEG = 2
+BINARY = 3
+FACTORIAL = 4
+
+OPERATORS = {'+': operator.add,
+             '-': operator.sub,
+             '*': operator.mul,
+             '/': operator.truediv,
+             '^': operator.pow}
+
+class CalcError(ValueError):
+    pass
+
+def error_message(e):
+
+    #Text of an error for the user. decimal's signals only hold the list
+    #of their conditions, so those are named after their class.
+    if isinstance(e,decimal.DecimalException):
+        return re.sub(r'(?<=[a-z])(?=[A-Z])'," ",type(e).__name__).lower()
+    return str(e).replace("\n"," ") or type(e).__name__
+
+class FloatArithmetic(object):
+
+    #Plain floats, or anything that acts like them such as NumPy arrays
+    operators = OPERATORS
+
+    def number(self, text):
+
+        return float(text)
+
+    def neg(self, a):
+
+        return -a
+
+    def factorial(self, a):
+
+        if a == int(a) and 0 <= a <= 170:
+            return float(math.factorial(int(a)))
+        return math.gamma(a + 1)
+
+FLOAT = FloatArithmetic()
+
+def scan(text, pos=0):
+
+    #Yields (kind, value, end) from pos on, kind being 'num', 'name', 'op'
+    #or 'bad' for a character that starts no token, which ends the scan
+    end = len(text.rstrip())
+    while pos < end:
+        m = TOKEN.match(text,pos)
+        if m is None:
+            pos = SPACE.match(text,pos).end()
+            yield ('bad',text[pos],pos + 1)
+            return
+        num,name,op = m.groups()
+        if num is not None:
+            yield ('num',num,m.end())
+        elif name is not None:
+            yield ('name',name,m.end())
+        else:
+            yield ('op','^' if op == '**' else op,m.end())
+        pos = m.end()
+
+def tokenize(text):
+
+    #Returns a list of (kind, value) with kind 'num', 'name' or 'op'
+    tokens = []
+    pos = 0
+    for kind,value,end in scan(text):
+        if kind == 'bad':
+            raise CalcError("unexpected %r at %d" % (value,end - 1))
+        tokens.append((kind,value))
+    return tokens
+
+#Binding of the operators, 'neg' being unary minus
+PRECEDENCE = {'+': 1, '-': 1, '*': 2, '/': 2, 'neg': 3, '^': 4}
+
+class Parser(object):
+
+    #Operator precedence parsing over the token list with explicit stacks,
+    #so that deep brackets or long runs of - or ^ cannot exhaust Python's
+    #stack. Builds tuples: ('num', text), ('name', name), ('neg', a),
+    #('!', a) and (op, a, b). - binds looser than ^ on its right, so -2^2
+    #is -(2^2), and ^ is right associative.
+    def __init__(self, tokens):
+
+        self.tokens = tokens
+
+    def parse(self):
+
+        if not self.tokens:
+            raise CalcError("empty expression")
+        operands = []
+        #Operators waiting for their right operand, and open brackets
+        pending = []
+        expect_operand = True
+        for kind,value in self.tokens:
+            if expect_operand:
+                if kind == 'num' or kind == 'name':
+                    operands.append((kind,value))
+                    expect_operand = False
+                elif value == '(' or value == '-':
+                    pending.append('neg' if value == '-' else value)
+                elif value != '+':
+                    raise CalcError("unexpected %r" % (value,))
+            elif value == '!':
+                operands.append(('!',operands.pop()))
+            elif value == ')':
+                while pending and pending[-1] != '(':
+                    self.reduce(operands,pending.pop())
+                if not pending:
+                    raise CalcError("unexpected %r" % (value,))
+                pending.pop()
+            elif kind == 'op' and value in PRECEDENCE:
+                binding = PRECEDENCE[value]
+                while pending and pending[-1] != '(':
+                    top = PRECEDENCE[pending[-1]]
+                    if top < binding or (top == binding and value == '^'):
+                        break
+                    self.reduce(operands,pending.pop())
+                pending.append(value)
+                expect_operand = True
+            elif '(' in pending:
+                raise CalcError("expected ')'")
+            else:
+                raise CalcError("unexpected %r" % (value,))
+        if expect_operand:
+            raise CalcError("unexpected end of expression")
+        while pending:
+            op = pending.pop()
+            if op == '(':
+                raise CalcError("expected ')'")
+            self.reduce(operands,op)
+        return operands[0]
+
+    def reduce(self, operands, op):
+
+        b = operands.pop()
+        if op == 'neg':
+            operands.append(('neg',b))
+        else:
+            operands.append((op,operands.pop(),b))
+
+class Expression(object):
+
+    #A compiled expression. code is a tuple of (opcode, argument) run on a
+    #stack; literals are kept as text in literals and converted once per
+    #arithmetic, so the same program runs on floats or exact numbers.
+    def __init__(self, source):
+
+        self.source = source
+        self.tree = Parser(tokenize(source)).parse()
+        self.literals = []
+        self.names = []
+        code = []
+        self.compile(self.tree,code)
+        self.code = tuple(code)
+        self.constants = {}
+
+    def compile(self, tree, code):
+
+        #Post order walk with an explicit stack, since the tree of a long
+        #sum is as deep as the sum is long
+        stack = [(tree,False)]
+        while stack:
+            tree,ready = stack.pop()
+            kind = tree[0]
+            if kind == 'num':
+                code.append((PUSH,len(self.literals)))
+                self.literals.append(tree[1])
+            elif kind == 'name':
+                if tree[1] not in self.names:
+                    self.names.append(tree[1])
+                code.append((LOAD,tree[1]))
+            elif not ready:
+                stack.append((tree,True))
+                for child in reversed(tree[1:]):
+                    stack.append((child,False))
+            elif kind == 'neg':
+                code.append((NEG,None))
+            elif kind == '!':
+                code.append((FACTORIAL,None))
+            else:
+                code.append((BINARY,kind))
+
+    def literal_values(self, arithmetic):
+
+        values = self.constants.get(arithmetic)
+        if values is None:
+            values = [arithmetic.number(text) for text in self.literals]
+            self.constants[arithmetic] = values
+        return values
+
+    def evaluate(self, variables=None, arithmetic=FLOAT):
+
+        literals = self.literal_values(arithmetic)
+        operators = arithmetic.operators
+        stack = []
+        push = stack.append
+        pop = stack.pop
+        for op,arg in self.code:
+            if op == PUSH:
+                push(literals[arg])
+            elif op == LOAD:
+                try:
+                    push(variables[arg])
+                except (KeyError,TypeError):
+                    raise CalcError("unknown name %r" % arg)
+            elif op == NEG:
+                stack[-1] = arithmetic.neg(stack[-1])
+            elif op == FACTORIAL:
+                stack[-1] = arithmetic.factorial(stack[-1])
+            else:
+                b = pop()
+                stack[-1] = operators[arg](stack[-1],b)
+        result = stack[0]
+        if isinstance(result,complex):
+            raise CalcError("complex result")
+        return result
+
+class ExpressionCache(object):
+
+    def __init__(self, size=CACHE_SIZE):
+
+        self.size = size
+        self.expressions = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, source):
+
+        source = source.strip()
+        expression = self.expressions.pop(source,None)
+        if expression is None:
+            self.misses += 1
+            expression = Expression(source)
+            if len(self.expressions) >= self.size:
+                self.expressions.popitem(last=False)
+        else:
+            self.hits += 1
+        self.expressions[source] = expression
+        return expression
+
+_cache = ExpressionCache()
+
+def compile_expression(source):
+
+    return _cache.get(source)
+
+def evaluate(source, variables=None, arithmetic=FLOAT):
+
+    return compile_expression(source).evaluate(variables,arithmetic)
+
+def common_prefix(a, b):
+
+    if b.startswith(a):
+        return len(a)
+    lo,hi = 0,min(len(a),len(b))
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if a[:mid] == b[:mid]:
+            lo = mid
+        else:
+            hi = mid - 1
+    return lo
+
+def common_suffix(a, b, limit):
+
+    lo,hi = 0,limit
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if a[len(a) - mid:] == b[len(b) - mid:]:
+            lo = mid
+        else:
+            hi = mid - 1
+    return lo
+
+#State of a term before its first token
+EMPTY = (None,None,True,None,None)
+
+class IncrementalEvaluator(object):
+
+    #Evaluates text while it is being typed, with the same precedence as
+    #Parser. Tokens are consumed left to right by an operator precedence
+    #stack machine that reduces as soon as precedence allows. Top level
+    #+ and - split the text into terms: each term is evaluated on its own,
+    #its value kept, and the sum folded from the term values.
+    #
+    #The state after each token is kept. It is (values, ops, wants operand,
+    #error, boundary) with the stacks as linked tuples, so keeping it costs
+    #nothing; boundary is (op, value of the term before) for a top level
+    #+ or -, after which the next term starts from EMPTY. An edit resumes
+    #from the state before the first token it touched, and once a top
+    #level + or - in the unchanged end of the text is reached again, the
+    #old states after it are reused and only the sum is folded again.
+    def __init__(self, variables=None, arithmetic=FLOAT):
+
+        self.variables = variables or {}
+        self.arithmetic = arithmetic
+        self.text = ""
+        self.ends = []
+        self.states = [EMPTY]
+        #Token index, (op, term value) and running sum of each boundary
+        self.marks = []
+        self.terms = []
+        self.sums = []
+
+    def update(self, text):
+
+        old = self.text
+        prefix = common_prefix(old,text)
+        tail = len(old) - common_suffix(old,text,min(len(old),len(text)) - prefix)
+        delta = len(text) - len(old)
+        #Up to two characters after a token can change it, as in 1e+5
+        keep = bisect.bisect_left(self.ends,prefix - 2)
+        first = bisect.bisect_left(self.marks,keep)
+        ends,states,marks,terms = self.ends,self.states,self.marks,self.terms
+        old_ends,old_states = ends[keep:],states[keep + 1:]
+        old_marks,old_terms = marks[first:],terms[first:]
+        del ends[keep:],states[keep + 1:],marks[first:],terms[first:]
+        pos = ends[-1] if ends else 0
+        state = states[-1]
+        for kind,value,end in scan(text,pos):
+            state = self.step(state,kind,value)
+            ends.append(end)
+            states.append(state)
+            if state[4] is None:
+                continue
+            t = len(ends) - 1
+            marks.append(t)
+            terms.append(state[4])
+            #The same + or - in the unchanged tail ends the same term
+            if end - 1 - delta < tail:
+                continue
+            j = bisect.bisect_left(old_ends,end - delta)
+            if (j < len(old_ends) and old_ends[j] == end - delta and
+                    old_states[j][4] is not None):
+                ends.extend([e + delta for e in old_ends[j + 1:]])
+                states.extend(old_states[j + 1:])
+                m = bisect.bisect_right(old_marks,j + keep)
+                marks.extend([i + t - j - keep for i in old_marks[m:]])
+                terms.extend(old_terms[m:])
+                break
+        self.text = text
+        del self.sums[first:]
+        self.fold(first)
+
+    def fold(self, first):
+
+        #Running sums from boundary first on, an error is kept in place of
+        #the sum
+        sums = self.sums
+        for j in range(first,len(self.terms)):
+            op,term = self.terms[j]
+            if j == 0:
+                sums.append(term)
+                continue
+            total = sums[j - 1]
+            if not isinstance(total,Exception):
+                try:
+                    total = self.arithmetic.operators[self.terms[j - 1][0]](total,term)
+                except (ValueError,ArithmeticError) as e:
+                    total = e
+            sums.append(total)
+
+    def step(self, state, kind, value):
+
+        values,ops,operand,error,boundary = state
+        if error is not None:
+            return state
+        arithmetic = self.arithmetic
+        try:
+            if operand:
+                if kind == 'num':
+                    return ((arithmetic.number(value),values),ops,False,None,None)
+                if kind == 'name':
+                    if value not in self.variables:
+                        raise CalcError("unknown name %r" % value)
+                    return ((self.variables[value],values),ops,False,None,None)
+                if value == '(':
+                    return (values,('(',ops),True,None,None)
+                if value == '-':
+                    return (values,('neg',ops),True,None,None)
+                if value == '+':
+                    return (values,ops,True,None,None)
+            elif value == '!':
+                return ((arithmetic.factorial(values[0]),values[1]),ops,
+                        False,None,None)
+            elif value == ')':
+                while ops is not None and ops[0] != '(':
+                    values,ops = self.reduce(values,ops)
+                if ops is None:
+                    raise CalcError("unexpected ')'")
+                return (values,ops[1],False,None,None)
+            elif value in PRECEDENCE:
+                p = PRECEDENCE[value]
+                while ops is not None and ops[0] != '(':
+                    top = PRECEDENCE[ops[0]]
+                    if top < p or (top == p and value == '^'):
+                        break
+                    values,ops = self.reduce(values,ops)
+                if ops is None and p == 1:
+                    return (None,None,True,None,(value,values[0]))
+                return (values,(value,ops),True,None,None)
+            raise CalcError("unexpected %r" % (value,))
+        except (ValueError,ArithmeticError) as e:
+            return (values,ops,operand,e,None)
+
+    def reduce(self, values, ops):
+
+        op,ops = ops
+        if op == 'neg':
+            return (self.arithmetic.neg(values[0]),values[1]),ops
+        b,(a,values) = values
+        return (self.arithmetic.operators[op](a,b),values),ops
+
+    def complete(self):
+
+        #Whether the whole text is an expression, with no operator left
+        #wanting an operand and no parenthesis open, so that value() is
+        #what evaluate() would give
+        values,ops,operand,error,boundary = self.states[-1]
+        if operand or error is not None:
+            return False
+        while ops is not None:
+            if ops[0] == '(':
+                return False
+            ops = ops[1]
+        return True
+
+    def value(self):
+
+        #Result of the longest prefix that ends in a complete operand, with
+        #any open parentheses closed; raises the error if there was one
+        for i in range(len(self.states) - 1,-1,-1):
+            values,ops,operand,error,boundary = self.states[i]
+            if error is not None:
+                raise error
+            if not operand:
+                break
+        else:
+            raise CalcError("empty expression")
+        while ops is not None:
+            if ops[0] == '(':
+                ops = ops[1]
+            else:
+                values,ops = self.reduce(values,ops)
+        result = values[0]
+        n = bisect.bisect_left(self.marks,i)
+        if n:
+            total = self.sums[n - 1]
+            if isinstance(total,Exception):
+                raise total
+            result = self.arithmetic.operators[self.terms[n - 1][0]](total,result)
+        if isinstance(result,complex):
+            raise CalcError("complex result")
+        return result
+
+def format_number(value):
+
+    if isinstance(value,float) and value.is_integer() and abs(value) < 1e16:
+        return str(int(value))
+    return str(value)
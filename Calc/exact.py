@@ -0,0 +1,309 @@
+import math,operator
+from fractions import Fraction
+from decimal import (Decimal, Context, Inexact, InvalidOperation,
+                     DivisionByZero, MAX_PREC, MAX_EMAX, MIN_EMIN)
+import engine
+
+#Exact arithmetic for the calculator. A value is a Decimal while it has a
+#finite decimal expansion and a Fraction otherwise, as with 1/3. Powers
+#with a fractional exponent that is not an exact root, and factorials of
+#fractions, fall back to float. Big integers are Decimals rather than ints
+#because libmpdec multiplies large numbers with number theoretic
+#transforms and turns them into digits in linear time, where str() of a
+#million digit int takes seconds.
+
+MAX_DIGITS = 5000000
+#Longest result worked out for the preview while typing
+PREVIEW_DIGITS = 50000
+#Roots above this degree are left to float
+MAX_ROOT = 1000
+#Longest fraction kept, in digits. Quotients that do not end and have
+#longer terms are refused rather than rounded, since turning long
+#Decimals into ints takes quadratic time.
+FRACTION_DIGITS = 20000
+#factorial() multiplies this many factors as ints before going to Decimal
+LEAF_FACTORS = 32
+CHUNK = 4096
+
+UNBOUNDED = Context(prec=MAX_PREC,Emax=MAX_EMAX,Emin=MIN_EMIN,
+                    traps=[InvalidOperation,DivisionByZero])
+
+def check_size(digits):
+
+    if digits > MAX_DIGITS:
+        raise engine.CalcError("result has more than %d digits" % MAX_DIGITS)
+
+def check_fraction(digits):
+
+    if digits > FRACTION_DIGITS:
+        raise engine.CalcError("fraction has more than %d digits" %
+                               FRACTION_DIGITS)
+
+def size(a):
+
+    #About how many digits a has, cheaply, for a limit on the result
+    if isinstance(a,float):
+        return 1
+    if isinstance(a,Fraction):
+        return (a.numerator.bit_length() + a.denominator.bit_length()) * 0.302
+    return abs(a.adjusted()) + max(-a.as_tuple().exponent,0) + 1
+
+def decimal_size(d):
+
+    #About how many digits d has, those after the point included
+    if not d:
+        return 1
+    magnitude = abs(float(d.copy_abs().log10(Context(prec=8))))
+    return magnitude + max(-d.as_tuple().exponent,0) + 1
+
+def to_fraction(a):
+
+    if isinstance(a,Fraction):
+        return a
+    return Fraction(a)
+
+def to_decimal(f):
+
+    #f as a Decimal if its expansion ends, else f itself
+    d = f.denominator
+    if d == 1:
+        return UNBOUNDED.create_decimal(f.numerator)
+    twos = (d & -d).bit_length() - 1
+    d >>= twos
+    fives = 0
+    while d % 5 == 0:
+        d //= 5
+        fives += 1
+    if d != 1:
+        return f
+    k = max(twos,fives)
+    scaled = f.numerator * (10 ** k // f.denominator)
+    return UNBOUNDED.scaleb(UNBOUNDED.create_decimal(scaled),-k)
+
+def combine(a, b, decimal_op, op):
+
+    if isinstance(a,float) or isinstance(b,float):
+        return op(float(a),float(b))
+    if isinstance(a,Decimal) and isinstance(b,Decimal):
+        return decimal_op(a,b)
+    return to_decimal(op(to_fraction(a),to_fraction(b)))
+
+def add(a, b):
+
+    return combine(a,b,UNBOUNDED.add,operator.add)
+
+def subtract(a, b):
+
+    return combine(a,b,UNBOUNDED.subtract,operator.sub)
+
+def multiply(a, b):
+
+    return combine(a,b,UNBOUNDED.multiply,operator.mul)
+
+def divide_decimals(a, b):
+
+    if not b:
+        raise ZeroDivisionError("division by zero")
+    #A quotient that ends has at most this many digits, so with this
+    #precision Inexact means the expansion goes on forever
+    a_digits = len(a.as_tuple().digits)
+    b_digits = len(b.as_tuple().digits)
+    context = Context(prec=a_digits + 4 * b_digits + 1,Emax=MAX_EMAX,
+                      Emin=MIN_EMIN,
+                      traps=[Inexact,InvalidOperation,DivisionByZero])
+    try:
+        return context.divide(a,b)
+    except Inexact:
+        check_fraction(decimal_size(a) + decimal_size(b))
+        return Fraction(a) / Fraction(b)
+
+def divide(a, b):
+
+    return combine(a,b,divide_decimals,operator.truediv)
+
+def iroot(n, q):
+
+    #Largest x with x ** q <= n, by Newton's method from above
+    if n < 2:
+        return n
+    x = 1 << -(-n.bit_length() // q)
+    while True:
+        y = ((q - 1) * x + n // x ** (q - 1)) // q
+        if y >= x:
+            return x
+        x = y
+
+def root(f, q):
+
+    #The exact q-th root of the Fraction f, or None
+    if f < 0:
+        if q % 2 == 0:
+            return None
+        r = root(-f,q)
+        return None if r is None else -r
+    n = iroot(f.numerator,q)
+    d = iroot(f.denominator,q)
+    if n ** q == f.numerator and d ** q == f.denominator:
+        return Fraction(n,d)
+    return None
+
+def power(a, b):
+
+    if isinstance(a,float) or isinstance(b,float):
+        return float(a) ** float(b)
+    #Anything but 0, 1 and -1 has at least |b| digits, checked before the
+    #slow conversion of a long b to a Fraction
+    if abs(b) > MAX_DIGITS and a not in (0,1,-1):
+        check_size(abs(b))
+    b = to_fraction(b)
+    if b.denominator != 1:
+        r = None
+        long_a = isinstance(a,Decimal) and decimal_size(a) > FRACTION_DIGITS
+        if b.denominator <= MAX_ROOT and not long_a:
+            r = root(to_fraction(a),b.denominator)
+        if r is None:
+            return float(a) ** float(b)
+        a = to_decimal(r)
+    e = b.numerator
+    if isinstance(a,Decimal):
+        if e == 0:
+            #1, as with floats, where Decimal calls 0 ^ 0 invalid
+            return UNBOUNDED.create_decimal(1)
+        if a in (0,1,-1) and e > 0:
+            return UNBOUNDED.power(a,e)
+        check_size(decimal_size(a) * abs(e))
+        if e < 0:
+            return divide(UNBOUNDED.create_decimal(1),UNBOUNDED.power(a,-e))
+        return UNBOUNDED.power(a,e)
+    a = to_fraction(a)
+    digits = (a.numerator.bit_length() + a.denominator.bit_length()) * 0.302
+    check_size(digits * abs(e))
+    check_fraction(digits * abs(e))
+    return to_decimal(a ** e)
+
+def product(lo, hi):
+
+    #lo * (lo + 1) * ... * (hi - 1), halving the range so that the big
+    #multiplications are between numbers of about the same size
+    if hi - lo <= LEAF_FACTORS:
+        p = 1
+        for i in range(lo,hi):
+            p *= i
+        return UNBOUNDED.create_decimal(p)
+    mid = (lo + hi) // 2
+    return UNBOUNDED.multiply(product(lo,mid),product(mid,hi))
+
+class ExactArithmetic(object):
+
+    #Results estimated to have more than max_digits digits are refused
+    #before they are worked out
+    def __init__(self, max_digits=MAX_DIGITS):
+
+        self.max_digits = max_digits
+        self.operators = {'+': add,
+                          '-': subtract,
+                          '*': self.multiply,
+                          '/': divide,
+                          '^': self.power}
+
+    def check(self, digits):
+
+        if digits > self.max_digits:
+            raise engine.CalcError("result has more than %d digits" %
+                                   self.max_digits)
+
+    def multiply(self, a, b):
+
+        self.check(size(a) + size(b))
+        return multiply(a,b)
+
+    def power(self, a, b):
+
+        if not isinstance(b,float) and a not in (0,1,-1):
+            self.check(size(a) * abs(float(b)))
+        return power(a,b)
+
+    def number(self, text):
+
+        return UNBOUNDED.create_decimal(text)
+
+    def neg(self, a):
+
+        #Decimal's own minus would round to the thread's context
+        if isinstance(a,Decimal):
+            return UNBOUNDED.minus(a)
+        return -a
+
+    def factorial(self, a):
+
+        if a > MAX_DIGITS:
+            check_size(a)
+        if isinstance(a,float) or to_fraction(a).denominator != 1 or a < 0:
+            return engine.FLOAT.factorial(float(a))
+        n = int(a)
+        self.check(math.lgamma(n + 1) / math.log(10))
+        return product(1,n + 1)
+
+EXACT = ExactArithmetic()
+PREVIEW = ExactArithmetic(PREVIEW_DIGITS)
+
+class Digits(object):
+
+    #The text of a result, of which only the requested part is built.
+    #parts are strings and, for the zeros of numbers like 1e1000000000,
+    #counts of zeros.
+    def __init__(self, value):
+
+        self.parts = self.split(value)
+        self.length = sum(p if isinstance(p,int) else len(p)
+                          for p in self.parts)
+
+    def split(self, value):
+
+        if isinstance(value,Fraction):
+            #By way of Decimal, as str() refuses ints of over 4300 digits
+            return [str(UNBOUNDED.create_decimal(value.numerator)),"/",
+                    str(UNBOUNDED.create_decimal(value.denominator))]
+        if not isinstance(value,Decimal):
+            return [engine.format_number(value)]
+        s = str(value)
+        if 'E' not in s:
+            return [s]
+        #Scientific notation, d.dddE+x, written out in full
+        mantissa,exponent = s.split('E')
+        exponent = int(exponent)
+        sign = "-" if mantissa.startswith("-") else ""
+        whole,point,fraction = mantissa.lstrip("-").partition(".")
+        if exponent >= len(fraction):
+            return [sign + whole + fraction,exponent - len(fraction)]
+        if exponent >= 0:
+            return [sign + whole + fraction[:exponent] + "." +
+                    fraction[exponent:]]
+        return [sign + "0.",-exponent - 1,whole + fraction]
+
+    def __len__(self):
+
+        return self.length
+
+    def text(self, start, stop):
+
+        out = []
+        pos = 0
+        for part in self.parts:
+            size = part if isinstance(part,int) else len(part)
+            lo = max(start - pos,0)
+            hi = min(stop - pos,size)
+            if lo < hi:
+                if isinstance(part,int):
+                    out.append("0" * (hi - lo))
+                else:
+                    out.append(part[lo:hi])
+            pos += size
+            if pos >= stop:
+                break
+        return "".join(out)
+
+    def chunks(self):
+
+        for start in range(0,self.length,CHUNK):
+            yield self.text(start,start + CHUNK)
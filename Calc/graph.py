@@ -0,0 +1,260 @@
+import math,bisect
+from kivy.uix.stencilview import StencilView
+from kivy.graphics import Color, Mesh
+from kivy.clock import Clock
+import engine
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+#Plots y = f(x) for an expression in x. Samples are kept, sorted by x, for
+#as long as the expression is shown, so panning and zooming only compute
+#what is new. A view first gets an even grid of about BASE_SAMPLES points
+#whose spacing is a power of two, so the grid points of one view are
+#mostly grid points of the next; refinement then adds midpoints where the
+#curve bends by more than TOLERANCE pixels, REFINE_BATCH points a frame.
+#Points are computed in one NumPy call per batch when NumPy is installed.
+
+BASE_SAMPLES = 256
+REFINE_BATCH = 512
+TOLERANCE = 0.5
+#Smallest spacing refinement goes down to, in pixels
+MIN_SPACING = 0.25
+MAX_SAMPLES = 200000
+
+class Sampler(object):
+
+    def __init__(self, expression):
+
+        self.expression = expression
+        self.xs = []
+        self.ys = []
+        self.known = set()
+
+    def evaluate(self, xs):
+
+        if numpy is not None:
+            with numpy.errstate(all='ignore'):
+                try:
+                    ys = self.expression.evaluate({'x': numpy.array(xs)})
+                    ys = numpy.broadcast_to(numpy.asarray(ys,dtype=float),
+                                            (len(xs),))
+                    return ys.tolist()
+                except (ValueError,ArithmeticError,TypeError):
+                    pass
+        ys = []
+        for x in xs:
+            try:
+                ys.append(float(self.expression.evaluate({'x': x})))
+            except (ValueError,ArithmeticError,TypeError):
+                ys.append(float('nan'))
+        return ys
+
+    def add(self, xs):
+
+        xs = sorted(x for x in set(xs) if x not in self.known)
+        if not xs:
+            return 0
+        ys = self.evaluate(xs)
+        self.known.update(xs)
+        #Merge the two sorted runs
+        merged_x = []
+        merged_y = []
+        i = j = 0
+        old_x,old_y = self.xs,self.ys
+        while i < len(old_x) and j < len(xs):
+            if old_x[i] < xs[j]:
+                merged_x.append(old_x[i])
+                merged_y.append(old_y[i])
+                i += 1
+            else:
+                merged_x.append(xs[j])
+                merged_y.append(ys[j])
+                j += 1
+        merged_x.extend(old_x[i:])
+        merged_y.extend(old_y[i:])
+        merged_x.extend(xs[j:])
+        merged_y.extend(ys[j:])
+        self.xs,self.ys = merged_x,merged_y
+        return len(xs)
+
+    def view(self, x0, x1):
+
+        #Indices of the samples in [x0, x1] plus one on either side
+        lo = max(bisect.bisect_left(self.xs,x0) - 1,0)
+        hi = min(bisect.bisect_right(self.xs,x1) + 1,len(self.xs))
+        return lo,hi
+
+    def cover(self, x0, x1):
+
+        step = 2.0 ** math.floor(math.log((x1 - x0) / BASE_SAMPLES,2))
+        first = int(math.floor(x0 / step))
+        last = int(math.ceil(x1 / step))
+        return self.add([i * step for i in range(first,last + 1)])
+
+    def refine(self, x0, x1, x_scale, y_scale, limit=REFINE_BATCH):
+
+        #Adds midpoints around samples that stand off the chord of their
+        #neighbours by more than TOLERANCE pixels, or next to a gap where
+        #the function is undefined. Returns how many were added.
+        lo,hi = self.view(x0,x1)
+        xs,ys = self.xs,self.ys
+        new = []
+        for i in range(lo + 1,hi - 1):
+            ax,bx,cx = xs[i - 1],xs[i],xs[i + 1]
+            if (cx - ax) * x_scale < 2 * MIN_SPACING:
+                continue
+            ay,by,cy = ys[i - 1],ys[i],ys[i + 1]
+            finite = [y == y and abs(y) != float('inf') for y in (ay,by,cy)]
+            if all(finite):
+                dx,dy = (cx - ax) * x_scale,(cy - ay) * y_scale
+                off = abs(dy * (bx - ax) * x_scale -
+                          (by - ay) * y_scale * dx) / math.hypot(dx,dy)
+                if off <= TOLERANCE:
+                    continue
+            elif not any(finite):
+                continue
+            new.append((ax + bx) / 2)
+            new.append((bx + cx) / 2)
+            if len(new) >= limit:
+                break
+        return self.add(new)
+
+    def trim(self, x0, x1):
+
+        #Forgets the samples outside [x0, x1] once there are too many
+        if len(self.xs) <= MAX_SAMPLES:
+            return
+        lo,hi = self.view(x0,x1)
+        self.xs = self.xs[lo:hi]
+        self.ys = self.ys[lo:hi]
+        self.known = set(self.xs)
+
+    def y_range(self, x0, x1):
+
+        #Range of most of the finite values, ignoring spikes near poles
+        lo,hi = self.view(x0,x1)
+        ys = sorted(y for y in self.ys[lo:hi]
+                    if y == y and abs(y) != float('inf'))
+        if not ys:
+            return -1.0,1.0
+        low = ys[len(ys) // 20]
+        high = ys[len(ys) - 1 - len(ys) // 20]
+        if high - low < 1e-9:
+            return low - 1.0,high + 1.0
+        pad = (high - low) * 0.1
+        return low - pad,high + pad
+
+class GraphView(StencilView):
+
+    #Draws the curve as a single Mesh in 'lines' mode, so breaks where the
+    #function is undefined cost nothing. Drag to pan, scroll to zoom.
+    def __init__(self, source, x_range=(-10.0,10.0), **kwargs):
+
+        super(GraphView,self).__init__(**kwargs)
+        self.sampler = Sampler(engine.compile_expression(source))
+        self.x0,self.x1 = x_range
+        self.y0 = self.y1 = None
+        with self.canvas:
+            Color(0.5,0.5,0.5)
+            self.axes = Mesh(mode='lines')
+            Color(1,1,1)
+            self.curve = Mesh(mode='lines')
+        self.refine_trigger = Clock.create_trigger(self.refine)
+        self.bind(pos=self.update,size=self.update)
+
+    def scales(self):
+
+        return (self.width / (self.x1 - self.x0),
+                self.height / (self.y1 - self.y0))
+
+    def update(self, *args):
+
+        self.sampler.cover(self.x0,self.x1)
+        if self.y0 is None:
+            self.y0,self.y1 = self.sampler.y_range(self.x0,self.x1)
+        self.draw()
+        self.refine_trigger()
+
+    def refine(self, *args):
+
+        x_scale,y_scale = self.scales()
+        if self.sampler.refine(self.x0,self.x1,x_scale,y_scale):
+            self.draw()
+            self.refine_trigger()
+        else:
+            self.sampler.trim(self.x0,self.x1)
+
+    def draw(self):
+
+        x_scale,y_scale = self.scales()
+        left,bottom = self.x,self.y
+        top = bottom + self.height
+        lo,hi = self.sampler.view(self.x0,self.x1)
+        xs,ys = self.sampler.xs,self.sampler.ys
+        vertices = []
+        indices = []
+        previous = None
+        n = 0
+        for i in range(lo,hi):
+            y = ys[i]
+            if y != y or abs(y) == float('inf'):
+                previous = None
+                continue
+            sy = bottom + (y - self.y0) * y_scale
+            #Keep far off points near the view, and do not join a point
+            #above it to one below, as at a pole of 1/x
+            sy = min(max(sy,bottom - self.height),top + self.height)
+            if previous is not None and not (
+                    (previous > top and sy < bottom) or
+                    (previous < bottom and sy > top)):
+                indices.append(n - 1)
+                indices.append(n)
+            vertices.extend((left + (xs[i] - self.x0) * x_scale,sy,0,0))
+            previous = sy
+            n += 1
+        self.curve.vertices = vertices
+        self.curve.indices = indices
+        ox = left + (0 - self.x0) * x_scale
+        oy = bottom + (0 - self.y0) * y_scale
+        self.axes.vertices = [left,oy,0,0,left + self.width,oy,0,0,
+                              ox,bottom,0,0,ox,top,0,0]
+        self.axes.indices = [0,1,2,3]
+
+    def on_touch_down(self, touch):
+
+        if not self.collide_point(*touch.pos):
+            return super(GraphView,self).on_touch_down(touch)
+        if touch.is_mouse_scrolling:
+            factor = 1.25 if touch.button == 'scrolldown' else 0.8
+            fx = self.x0 + (touch.x - self.x) / self.width * (self.x1 - self.x0)
+            fy = self.y0 + (touch.y - self.y) / self.height * (self.y1 - self.y0)
+            self.x0 = fx + (self.x0 - fx) * factor
+            self.x1 = fx + (self.x1 - fx) * factor
+            self.y0 = fy + (self.y0 - fy) * factor
+            self.y1 = fy + (self.y1 - fy) * factor
+            self.update()
+            return True
+        touch.grab(self)
+        return True
+
+    def on_touch_move(self, touch):
+
+        if touch.grab_current is not self:
+            return super(GraphView,self).on_touch_move(touch)
+        x_scale,y_scale = self.scales()
+        self.x0 -= touch.dx / x_scale
+        self.x1 -= touch.dx / x_scale
+        self.y0 -= touch.dy / y_scale
+        self.y1 -= touch.dy / y_scale
+        self.update()
+        return True
+
+    def on_touch_up(self, touch):
+
+        if touch.grab_current is not self:
+            return super(GraphView,self).on_touch_up(touch)
+        touch.ungrab(self)
+        return True
@@ -0,0 +1,120 @@
+import os,sys,signal,argparse,asyncio
+from concurrent.futures import ProcessPoolExecutor
+import engine,exact
+
+#Headless evaluation service. One expression per line in, one line out:
+#
+#    2*(3+4)           ->  ok 14
+#    exact:2^100       ->  ok 1267650600228229401496703205376
+#    1/                ->  error unexpected end of expression
+#
+#Requests are evaluated on the event loop through the engine's shared
+#cache of compiled expressions, except exact ones with ^ or !, which can
+#take seconds and go to a process pool. Replies on a connection come back
+#in the order of its requests.
+
+LINE_LIMIT = 1 << 20
+#Longest reply text, exact results beyond it are refused
+MAX_REPLY = 1 << 24
+EXACT_PREFIX = "exact:"
+
+def compute(source, exact_mode):
+
+    #Returns the reply line for one request, run in the server or a worker
+    try:
+        if exact_mode:
+            digits = exact.Digits(engine.evaluate(source,None,exact.EXACT))
+            if len(digits) > MAX_REPLY:
+                raise engine.CalcError("result has %d digits" % len(digits))
+            text = digits.text(0,len(digits))
+        else:
+            text = engine.format_number(engine.evaluate(source))
+        return "ok " + text + "\n"
+    except (ValueError,ArithmeticError) as e:
+        return "error %s\n" % engine.error_message(e)
+
+def expensive(source, exact_mode):
+
+    return exact_mode and ('^' in source or '!' in source)
+
+class CalcServer(object):
+
+    def __init__(self, workers=None):
+
+        self.pool = ProcessPoolExecutor(workers)
+        self.requests = 0
+        self.offloaded = 0
+
+    async def evaluate(self, line):
+
+        source = line.strip()
+        exact_mode = source.startswith(EXACT_PREFIX)
+        if exact_mode:
+            source = source[len(EXACT_PREFIX):]
+        self.requests += 1
+        if expensive(source,exact_mode):
+            self.offloaded += 1
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self.pool,compute,source,True)
+        return compute(source,exact_mode)
+
+    async def handle(self, reader, writer):
+
+        try:
+            while True:
+                try:
+                    line = await reader.readline()
+                except ValueError:
+                    writer.write(b"error line too long\n")
+                    break
+                if not line:
+                    break
+                reply = await self.evaluate(line.decode('utf-8','replace'))
+                writer.write(reply.encode('utf-8'))
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, host="127.0.0.1", port=8765, path=None):
+
+        #Serves until cancelled, which SIGTERM does too, so that the caller
+        #gets to close() and the pool's workers are not left running
+        loop = asyncio.get_running_loop()
+        loop.add_signal_handler(signal.SIGTERM,asyncio.current_task().cancel)
+        if path is not None:
+            server = await asyncio.start_unix_server(self.handle,path,
+                                                     limit=LINE_LIMIT)
+        else:
+            server = await asyncio.start_server(self.handle,host,port,
+                                                limit=LINE_LIMIT)
+        try:
+            async with server:
+                await server.serve_forever()
+        except asyncio.CancelledError:
+            pass
+
+    def close(self):
+
+        self.pool.shutdown()
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description="Calc evaluation server")
+    parser.add_argument("--host",default="127.0.0.1")
+    parser.add_argument("--port",type=int,default=8765)
+    parser.add_argument("--unix",metavar="PATH",
+                        help="listen on a unix socket instead of tcp")
+    parser.add_argument("--workers",type=int,default=None,
+                        help="processes for big number work")
+    args = parser.parse_args()
+    if args.unix is not None and os.path.exists(args.unix):
+        os.unlink(args.unix)
+    server = CalcServer(args.workers)
+    try:
+        asyncio.run(server.serve(args.host,args.port,args.unix))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
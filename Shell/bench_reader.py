@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+import os,sys,pty,fcntl,time,threading
+from ptyio import PtyReader
+
+#Compares the old byte at a time reader with PtyReader on a pipe fed by a
+#writer thread. Usage: python bench_reader.py [megabytes]
+
+def old_read(fd):
+
+    s = b''
+    d = b'1'
+    try:
+        while d != b'':
+            d = os.read(fd,1)
+            s += d
+    except OSError:
+        pass
+    return s
+
+def run(read, size):
+
+    r,w = os.pipe()
+    fl = fcntl.fcntl(r,fcntl.F_GETFL)
+    fcntl.fcntl(r,fcntl.F_SETFL,fl|os.O_NONBLOCK)
+    line = u'été olá 世界 - some log output\n'.encode('utf-8')
+    data = line*(size//len(line))
+
+    def writer():
+        view = memoryview(data)
+        while len(view):
+            n = os.write(w,view[:65536])
+            view = view[n:]
+        os.close(w)
+
+    thread = threading.Thread(target=writer)
+    start = time.time()
+    thread.start()
+    total = 0
+    while total < len(data):
+        total += len(read(r))
+    elapsed = time.time() - start
+    thread.join()
+    os.close(r)
+    return total/elapsed
+
+if __name__ == '__main__':
+
+    mb = 4
+    if len(sys.argv) > 1:
+        mb = int(sys.argv[1])
+
+    reader = PtyReader(None)
+    def new_read(fd):
+        reader.fd = fd
+        return reader.read_bytes()
+
+    print("old reader: %10.2f MB/s" % (run(old_read,min(mb,1) << 20)/1e6))
+    print("PtyReader:  %10.2f MB/s" % (run(new_read,mb << 20)/1e6))
@@ -0,0 +1,73 @@
+import os,sys,time,resource
+from sessions import SessionManager
+
+#CPU and memory of the session manager with 1, 10 and 50 shells, idle and
+#while every shell prints a burst of output. The active session is parsed
+#here the way MainWindow.readOutput does; background ones only buffer.
+#Usage: python bench_sessions.py [counts...]
+
+BURST = "seq 1 50000\n"
+BURST_CHARS = sum(len("%d\r\n" % i) for i in range(1,50001))
+
+def cpu():
+
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+def rss_mb():
+
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1])/1024.0
+    return 0.0
+
+def drain(manager, targets, quiet=0.5):
+
+    #Parses the active session until every session read at least its
+    #target chars and then nothing for quiet seconds
+    last = time.time()
+    total = -1
+    while True:
+        s,stamp = manager.active.channel.take()
+        if s:
+            manager.active.terminal.feed(s)
+        reads = [x.channel.stats.chars_read for x in manager.sessions]
+        if sum(reads) != total:
+            total = sum(reads)
+            last = time.time()
+        done = all(r >= t for r,t in zip(reads,targets))
+        if done and time.time() - last >= quiet:
+            return
+        time.sleep(0.01)
+
+def bench(count, idle=2.0):
+
+    manager = SessionManager()
+    for i in range(0,count):
+        manager.new_session()
+    #Wait for every prompt
+    drain(manager,[1]*count)
+
+    start = cpu()
+    time.sleep(idle)
+    idle_cpu = (cpu() - start)/idle
+
+    start = cpu()
+    targets = [x.channel.stats.chars_read + BURST_CHARS
+               for x in manager.sessions]
+    for session in manager.sessions:
+        os.write(session.fd,BURST.encode())
+    drain(manager,targets)
+    burst_cpu = cpu() - start
+    rss = rss_mb()
+    manager.stop()
+    return idle_cpu,burst_cpu,rss
+
+if __name__ == '__main__':
+
+    counts = [int(a) for a in sys.argv[1:]] or [1,10,50]
+    print("%9s %12s %12s %9s" % ("sessions","idle cpu %","burst cpu s","rss MB"))
+    for count in counts:
+        idle_cpu,burst_cpu,rss = bench(count)
+        print("%9d %12.2f %12.2f %9.1f" % (count,idle_cpu*100,burst_cpu,rss))
@@ -0,0 +1,144 @@
+import io,os
+from bisect import bisect_left
+
+HISTORY_FILE = os.path.expanduser("~/.kivyshell_history")
+MAX_ENTRIES = 10000
+PREFIX_LEN = 32
+NGRAM = 3
+
+class History(object):
+
+    #Commands in entry order, saved to path as they are added. Two indexes
+    #map keys to ascending lists of entry numbers: every prefix of up to
+    #PREFIX_LEN chars, and every substring of up to NGRAM chars. Lookups go
+    #through the lists from the newest end instead of scanning entries.
+    #Past max_entries the oldest entry is dropped. Numbers count from the
+    #first entry ever added, so those held by a caller stay valid; start is
+    #the oldest one kept and end() one past the newest. Dropped numbers
+    #are left at the head of their lists until they are half of one.
+    def __init__(self, path=HISTORY_FILE, max_entries=MAX_ENTRIES):
+
+        self.path = path
+        self.max_entries = max_entries
+        self.entries = []
+        self.start = 0
+        self.prefixes = {}
+        self.ngrams = {}
+        if path is not None and os.path.exists(path):
+            with io.open(path,encoding='utf-8',errors='replace') as f:
+                lines = f.read().splitlines()
+            for command in lines[-max_entries:]:
+                self.index(command)
+
+    def __len__(self):
+
+        return len(self.entries)
+
+    def end(self):
+
+        return self.start + len(self.entries)
+
+    def entry(self, n):
+
+        return self.entries[n - self.start]
+
+    def keys(self, command):
+
+        #(index, key) of every list command is in
+        for i in range(1,min(len(command),PREFIX_LEN) + 1):
+            yield self.prefixes,command[:i]
+        seen = set()
+        for size in range(1,NGRAM + 1):
+            for i in range(0,len(command) - size + 1):
+                gram = command[i:i + size]
+                if gram not in seen:
+                    seen.add(gram)
+                    yield self.ngrams,gram
+
+    def index(self, command):
+
+        n = self.end()
+        self.entries.append(command)
+        for table,key in self.keys(command):
+            table.setdefault(key,[]).append(n)
+
+    def drop_oldest(self):
+
+        command = self.entries.pop(0)
+        self.start += 1
+        for table,key in self.keys(command):
+            postings = table[key]
+            i = bisect_left(postings,self.start)
+            if i == len(postings):
+                del table[key]
+            elif 2 * i >= len(postings):
+                del postings[:i]
+
+    def add(self, command):
+
+        command = command.strip()
+        if command == "" or (self.entries and self.entries[-1] == command):
+            return
+        self.index(command)
+        while len(self.entries) > self.max_entries:
+            self.drop_oldest()
+        if self.path is not None:
+            with io.open(self.path,'a',encoding='utf-8') as f:
+                f.write(command + u"\n")
+
+    def previous(self, prefix, before=None):
+
+        #Newest entry numbered below before that starts with prefix, as
+        #(number, command), or None
+        if before is None:
+            before = self.end()
+        if prefix == "":
+            if before > self.start:
+                return before - 1,self.entry(before - 1)
+            return None
+        postings = self.prefixes.get(prefix[:PREFIX_LEN],[])
+        i = bisect_left(postings,before) - 1
+        while i >= 0 and postings[i] >= self.start:
+            n = postings[i]
+            if self.entry(n).startswith(prefix):
+                return n,self.entry(n)
+            i -= 1
+        return None
+
+    def next(self, prefix, after):
+
+        #Oldest entry numbered above after that starts with prefix
+        if prefix == "":
+            if after + 1 < self.end():
+                return after + 1,self.entry(after + 1)
+            return None
+        postings = self.prefixes.get(prefix[:PREFIX_LEN],[])
+        i = bisect_left(postings,max(after + 1,self.start))
+        while i < len(postings):
+            n = postings[i]
+            if self.entry(n).startswith(prefix):
+                return n,self.entry(n)
+            i += 1
+        return None
+
+    def search(self, text, before=None):
+
+        #Newest entry numbered below before containing text, the lookup
+        #behind reverse incremental search
+        if before is None:
+            before = self.end()
+        if text == "":
+            return None
+        if len(text) <= NGRAM:
+            postings = self.ngrams.get(text,[])
+        else:
+            #Walk the rarest of the query's ngrams
+            grams = [text[i:i + NGRAM] for i in range(0,len(text) - NGRAM + 1)]
+            postings = min([self.ngrams.get(g,[]) for g in grams],key=len)
+        i = bisect_left(postings,before) - 1
+        while i >= 0 and postings[i] >= self.start:
+            n = postings[i]
+            if text in self.entry(n):
+                return n,self.entry(n)
+            i -= 1
+        return None
@@ -0,0 +1,345 @@
+import os,errno,codecs,time,selectors,threading,fcntl
+from collections import deque
+
+CHUNK_SIZE = 65536
+MAX_READ = 1 << 20
+MAX_PENDING = 4 << 20
+WRITE_CHUNK = 4096
+MAX_WRITE_QUEUE = 64 << 20
+
+class PtyReader(object):
+
+    #Drains a non blocking pty fd in large chunks. The incremental decoder
+    #keeps the bytes of a utf-8 character split across two reads until the
+    #rest of it arrives. If recorder is set, every chunk read is passed to
+    #its write(stamp, data).
+    def __init__(self, fd, chunk_size=CHUNK_SIZE, max_read=MAX_READ):
+
+        self.fd = fd
+        self.chunk_size = chunk_size
+        self.max_read = max_read
+        self.decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+        self.eof = False
+        self.bytes_read = 0
+        self.read_time = 0.0
+        self.recorder = None
+
+    def read_bytes(self):
+
+        #Returns at most max_read bytes, whatever is available right now
+        chunks = []
+        size = 0
+        start = time.time()
+        while size < self.max_read:
+            try:
+                data = os.read(self.fd,self.chunk_size)
+            except OSError as e:
+                if e.errno in (errno.EAGAIN,errno.EWOULDBLOCK):
+                    break
+                #Linux reports a closed pty as EIO, EBADF means the
+                #session was closed under us
+                if e.errno in (errno.EIO,errno.EBADF):
+                    self.eof = True
+                    break
+                raise
+            if not data:
+                self.eof = True
+                break
+            chunks.append(data)
+            size += len(data)
+            if self.recorder is not None:
+                self.recorder.write(time.time(),data)
+
+        self.read_time += time.time() - start
+        self.bytes_read += size
+        return b''.join(chunks)
+
+    def decode(self, data):
+
+        return self.decoder.decode(data,self.eof)
+
+    def read(self):
+
+        return self.decode(self.read_bytes())
+
+    def throughput(self):
+
+        #Bytes per second spent inside read_bytes
+        if self.read_time == 0:
+            return 0.0
+        return self.bytes_read/self.read_time
+
+class FlowStats(object):
+
+    def __init__(self):
+
+        self.chars_read = 0
+        self.chars_rendered = 0
+        self.chars_dropped = 0
+        self.frames_skipped = 0
+        self.latency = 0.0
+        self.max_latency = 0.0
+        self.bytes_written = 0
+        self.max_write_queue = 0
+
+    def painted(self, chars, stamp):
+
+        #stamp is when the oldest of the painted chars was read
+        self.chars_rendered += chars
+        if stamp is not None:
+            self.latency = time.time() - stamp
+            self.max_latency = max(self.max_latency,self.latency)
+
+    def __str__(self):
+
+        return ("read %d rendered %d dropped %d skipped frames %d "
+                "latency %.1f ms (max %.1f ms) written %d "
+                "max write queue %d" %
+                (self.chars_read,self.chars_rendered,self.chars_dropped,
+                 self.frames_skipped,self.latency*1e3,self.max_latency*1e3,
+                 self.bytes_written,self.max_write_queue))
+
+class PtyChannel(object):
+
+    #Output of one pty waiting for the ui thread. The watcher thread reads
+    #into pending and calls notify, if set, which is expected to be a
+    #Clock trigger coalescing calls to at most one per frame. If the ui
+    #falls more than max_pending chars behind, the oldest output is
+    #dropped, as it would only scroll out of the scrollback anyway.
+    #
+    #Input goes the other way through a write queue: send() only queues
+    #the bytes and the watcher writes them WRITE_CHUNK bytes at a time
+    #whenever the pty can take more, so large pastes never block the ui
+    #and never lose the part a full pty refused.
+    def __init__(self, reader, notify=None, max_pending=MAX_PENDING,
+                 max_write_queue=MAX_WRITE_QUEUE):
+
+        self.reader = reader
+        self.notify = notify
+        self.max_pending = max_pending
+        self.max_write_queue = max_write_queue
+        self.lock = threading.Lock()
+        self.pending = []
+        self.pending_len = 0
+        #Set with the last output, under lock, see ended()
+        self.eof = False
+        self.write_lock = threading.Lock()
+        self.write_queue = deque()
+        self.write_queued = 0
+        self.watcher = None
+        self.stats = FlowStats()
+
+    def fileno(self):
+
+        return self.reader.fd
+
+    def read_ready(self):
+
+        #Called by the watcher thread when the fd is readable
+        s = self.reader.read()
+        if s == "" and not self.reader.eof:
+            return
+        with self.lock:
+            self.pending.append((time.time(),s))
+            self.pending_len += len(s)
+            self.stats.chars_read += len(s)
+            if self.pending_len > self.max_pending:
+                self.trim()
+            if self.reader.eof:
+                self.eof = True
+        notify = self.notify
+        if notify is not None:
+            notify()
+
+    def trim(self):
+
+        pending = self.pending
+        while self.pending_len - len(pending[0][1]) >= self.max_pending:
+            stamp,s = pending.pop(0)
+            self.pending_len -= len(s)
+            self.stats.chars_dropped += len(s)
+        #Restart on a line boundary
+        stamp,s = pending[0]
+        cut = s.find("\n") + 1
+        pending[0] = (stamp,s[cut:])
+        self.pending_len -= cut
+        self.stats.chars_dropped += cut
+
+    def send(self, data):
+
+        #Queues data for the pty. Returns False, queueing nothing, if that
+        #would take the queue past max_write_queue bytes.
+        if not data:
+            return True
+        with self.write_lock:
+            if self.write_queued + len(data) > self.max_write_queue:
+                return False
+            self.write_queue.append(memoryview(data))
+            self.write_queued += len(data)
+            self.stats.max_write_queue = max(self.stats.max_write_queue,
+                                             self.write_queued)
+        if self.watcher is not None:
+            self.watcher.wake()
+        return True
+
+    def write_pending(self):
+
+        return self.write_queued > 0
+
+    def write_ready(self):
+
+        #Called by the watcher thread when the fd is writable
+        with self.write_lock:
+            queue = self.write_queue
+            while queue:
+                chunk = queue[0]
+                try:
+                    n = os.write(self.reader.fd,chunk[:WRITE_CHUNK])
+                except OSError as e:
+                    if e.errno in (errno.EAGAIN,errno.EWOULDBLOCK):
+                        return
+                    if e.errno in (errno.EIO,errno.EBADF):
+                        queue.clear()
+                        self.write_queued = 0
+                        return
+                    raise
+                if n == len(chunk):
+                    queue.popleft()
+                else:
+                    queue[0] = chunk[n:]
+                self.write_queued -= n
+                self.stats.bytes_written += n
+
+    def has_pending(self):
+
+        return self.pending_len > 0
+
+    def ended(self):
+
+        #True once the pty closed and all its output has been taken. The
+        #reader's own eof is set before the last chunk reaches pending.
+        with self.lock:
+            return self.eof and self.pending_len == 0
+
+    def take(self, limit=None):
+
+        #Returns (text, stamp) with at most limit chars of the oldest
+        #output and the time the first of them was read
+        with self.lock:
+            if not self.pending:
+                return "",None
+            stamp = self.pending[0][0]
+            if limit is None or limit >= self.pending_len:
+                s = "".join([c for t,c in self.pending])
+                self.pending = []
+                self.pending_len = 0
+                return s,stamp
+
+            parts = []
+            size = 0
+            while size < limit:
+                t,c = self.pending[0]
+                if size + len(c) > limit:
+                    c,rest = c[:limit - size],c[limit - size:]
+                    self.pending[0] = (t,rest)
+                else:
+                    self.pending.pop(0)
+                parts.append(c)
+                size += len(c)
+            self.pending_len -= size
+            return "".join(parts),stamp
+
+class PtyWatcher(threading.Thread):
+
+    #One background thread waiting on every pty at once, so idle shells
+    #cost no cpu and children never block on a full pty. It also writes
+    #the channels' queued input as the ptys accept it. Channels can be
+    #added and removed from any thread; the wake up pipe makes the loop
+    #pick up the new set, which it registers with its selector, so the
+    #number of sessions is not bounded by FD_SETSIZE as with select().
+    def __init__(self):
+
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.lock = threading.Lock()
+        self.channels = {}
+        self.wake_r,self.wake_w = os.pipe()
+        fl = fcntl.fcntl(self.wake_w,fcntl.F_GETFL)
+        fcntl.fcntl(self.wake_w,fcntl.F_SETFL,fl|os.O_NONBLOCK)
+        self.running = True
+
+    def add(self, channel):
+
+        channel.watcher = self
+        with self.lock:
+            self.channels[channel.fileno()] = channel
+        self.wake()
+
+    def remove(self, channel):
+
+        with self.lock:
+            self.channels.pop(channel.fileno(),None)
+        self.wake()
+
+    def wake(self):
+
+        try:
+            os.write(self.wake_w,b'x')
+        except OSError as e:
+            #A full pipe will wake the loop anyway
+            if e.errno not in (errno.EAGAIN,errno.EWOULDBLOCK):
+                raise
+
+    def update(self, selector):
+
+        #Brings the selector in line with the channels: each is registered
+        #for reading, and for writing while it has input queued
+        with self.lock:
+            channels = dict(self.channels)
+        for key in list(selector.get_map().values()):
+            if key.fd != self.wake_r and channels.get(key.fd) is not key.data:
+                #Removed, or its fd already reused by a new session
+                selector.unregister(key.fd)
+        for fd,channel in channels.items():
+            events = selectors.EVENT_READ
+            if channel.write_pending():
+                events |= selectors.EVENT_WRITE
+            try:
+                key = selector.get_key(fd)
+            except KeyError:
+                key = None
+            try:
+                if key is None:
+                    selector.register(fd,events,channel)
+                elif key.events != events:
+                    selector.modify(fd,events,channel)
+            except (OSError,ValueError):
+                #Closed since it was added, its removal is already in the
+                #wake up pipe
+                pass
+
+    def run(self):
+
+        selector = selectors.DefaultSelector()
+        selector.register(self.wake_r,selectors.EVENT_READ)
+        try:
+            while self.running:
+                self.update(selector)
+                for key,events in selector.select():
+                    if key.fd == self.wake_r:
+                        os.read(self.wake_r,4096)
+                        continue
+                    channel = key.data
+                    if events & selectors.EVENT_WRITE:
+                        channel.write_ready()
+                    if events & selectors.EVENT_READ:
+                        channel.read_ready()
+                        if channel.reader.eof:
+                            self.remove(channel)
+        finally:
+            selector.close()
+
+    def stop(self):
+
+        self.running = False
+        self.wake()
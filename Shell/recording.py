@@ -0,0 +1,120 @@
+import os,sys,time,struct,fcntl,threading
+from ptyio import PtyReader, PtyChannel, PtyWatcher
+from scrollback import Scrollback
+from terminal import Screen, Terminal
+
+#A recording is MAGIC followed by one record per pty read: a RECORD
+#header (time of the read, byte count) and the bytes as read.
+MAGIC = b'KSHREC1\n'
+RECORD = struct.Struct('<dI')
+FRAME_CHARS = 65536
+
+class Recorder(object):
+
+    #Appends every chunk a PtyReader reads to path. Only the reader's
+    #thread writes to it.
+    def __init__(self, path):
+
+        new = not os.path.exists(path) or os.path.getsize(path) == 0
+        self.file = open(path,'ab')
+        if new:
+            self.file.write(MAGIC)
+
+    def write(self, stamp, data):
+
+        self.file.write(RECORD.pack(stamp,len(data)))
+        self.file.write(data)
+
+    def close(self):
+
+        self.file.close()
+
+def read_recording(path):
+
+    #Yields (stamp, data) for every record in path
+    with open(path,'rb') as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError("%s is not a shell recording" % path)
+        while True:
+            header = f.read(RECORD.size)
+            if len(header) < RECORD.size:
+                return
+            stamp,size = RECORD.unpack(header)
+            data = f.read(size)
+            if len(data) < size:
+                return
+            yield stamp,data
+
+def replay(path, realtime=False, rows=24, cols=80):
+
+    #Feeds a recording through a pipe into the same PtyReader, PtyChannel,
+    #Terminal and Scrollback the shell uses, consuming output in frame
+    #sized steps like MainWindow.readOutput. Returns (bytes, seconds,
+    #stats).
+    r,w = os.pipe()
+    fl = fcntl.fcntl(r,fcntl.F_GETFL)
+    fcntl.fcntl(r,fcntl.F_SETFL,fl|os.O_NONBLOCK)
+    records = list(read_recording(path))
+    total = sum(len(data) for stamp,data in records)
+
+    def writer():
+        first = None
+        start = time.time()
+        for stamp,data in records:
+            if realtime:
+                if first is None:
+                    first = stamp
+                delay = (stamp - first) - (time.time() - start)
+                if delay > 0:
+                    time.sleep(delay)
+            view = memoryview(data)
+            while len(view):
+                n = os.write(w,view)
+                view = view[n:]
+        os.close(w)
+
+    scrollback = Scrollback()
+    terminal = Terminal(Screen(rows,cols,scrollback.add_line))
+    done = threading.Event()
+    reader = PtyReader(r)
+    channel = PtyChannel(reader,done.set,max_pending=1 << 30)
+    watcher = PtyWatcher()
+    watcher.add(channel)
+    watcher.start()
+    thread = threading.Thread(target=writer)
+    start = time.time()
+    thread.start()
+    while True:
+        done.wait(0.05)
+        done.clear()
+        chars = 0
+        first_stamp = None
+        while True:
+            s,stamp = channel.take(FRAME_CHARS)
+            if s == "":
+                break
+            if first_stamp is None:
+                first_stamp = stamp
+            terminal.feed(s)
+            terminal.screen.take_dirty()
+            chars += len(s)
+        if chars:
+            channel.stats.painted(chars,first_stamp)
+        if channel.ended():
+            break
+    elapsed = time.time() - start
+    thread.join()
+    watcher.stop()
+    os.close(r)
+    return reader.bytes_read,elapsed,channel.stats
+
+if __name__ == '__main__':
+
+    #python recording.py [--realtime] file...
+    args = sys.argv[1:]
+    realtime = '--realtime' in args
+    for path in [a for a in args if a != '--realtime']:
+        size,elapsed,stats = replay(path,realtime)
+        print("%s: %d bytes in %.3f s, %.2f MB/s" %
+              (path,size,elapsed,size/elapsed/1e6))
+        print("    %s" % stats)
@@ -0,0 +1,107 @@
+import threading
+
+class RingBuffer(object):
+
+    #Fixed capacity list, once full every append drops the oldest item.
+    #Indexing and appending are O(1). dropped counts the items pushed out,
+    #so item i is the (dropped + i)th ever appended.
+    def __init__(self, capacity):
+
+        self.capacity = capacity
+        self.items = [None]*capacity
+        self.start = 0
+        self.size = 0
+        self.dropped = 0
+
+    def __len__(self):
+
+        return self.size
+
+    def append(self, item):
+
+        end = (self.start + self.size) % self.capacity
+        self.items[end] = item
+        if self.size < self.capacity:
+            self.size += 1
+        else:
+            self.start = (self.start + 1) % self.capacity
+            self.dropped += 1
+
+    def extend(self, items):
+
+        for item in items:
+            self.append(item)
+
+    def __getitem__(self, i):
+
+        if i < 0:
+            i += self.size
+        if i < 0 or i >= self.size:
+            raise IndexError(i)
+        return self.items[(self.start + i) % self.capacity]
+
+    def slice(self, first, last):
+
+        first = max(first,0)
+        last = min(last,self.size)
+        if first >= last:
+            return []
+        a = (self.start + first) % self.capacity
+        b = (self.start + last) % self.capacity
+        if a < b:
+            return self.items[a:b]
+        return self.items[a:] + self.items[:b]
+
+class Scrollback(object):
+
+    #Lines that scrolled off the terminal screen, in a RingBuffer capped at
+    #max_lines. Adding a line never touches the stored ones. The numbered
+    #methods are for a search on another thread, and lock out add_line.
+    def __init__(self, max_lines=10000):
+
+        self.lines = RingBuffer(max_lines)
+        self.lock = threading.Lock()
+
+    def __len__(self):
+
+        return len(self.lines)
+
+    def add_line(self, line):
+
+        with self.lock:
+            self.lines.append(line)
+
+    def line(self, i):
+
+        return self.lines[i]
+
+    def first_number(self):
+
+        #Lines are numbered from the first ever added, so numbers stay
+        #valid while old lines are dropped
+        with self.lock:
+            return self.lines.dropped
+
+    def end_number(self):
+
+        with self.lock:
+            return self.lines.dropped + len(self.lines)
+
+    def numbered_slice(self, first, last):
+
+        #Lines numbered first to last - 1, those still kept
+        with self.lock:
+            dropped = self.lines.dropped
+            return self.lines.slice(first - dropped,last - dropped)
+
+    def window(self, rows, scroll=0, tail=()):
+
+        #The rows lines ending scroll lines above the bottom of the
+        #scrollback followed by tail, the lines still on the screen
+        total = len(self.lines) + len(tail)
+        end = max(total - scroll,1)
+        first = max(end - rows,0)
+        count = len(self.lines)
+        lines = self.lines.slice(first,min(end,count))
+        lines.extend(tail[max(first - count,0):max(end - count,0)])
+        return lines
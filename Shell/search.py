@@ -0,0 +1,90 @@
+import re,threading
+
+BLOCK_LINES = 4096
+
+class ScrollbackSearch(threading.Thread):
+
+    #Finds pattern in a Scrollback on a worker thread, from the newest line
+    #back. Lines are searched BLOCK_LINES at a time as one joined string,
+    #so the scanning happens inside the regex engine, and matches are
+    #addressed by line number, which stays valid while new output arrives.
+    #Each block's hits are appended to matches, newest first, and notify
+    #is called; done is set at the end.
+    def __init__(self, scrollback, pattern, regex=False, ignore_case=True,
+                 notify=None):
+
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.scrollback = scrollback
+        flags = re.M
+        if ignore_case:
+            flags |= re.I
+        if not regex:
+            pattern = re.escape(pattern)
+        self.pattern = re.compile(pattern,flags)
+        self.notify = notify
+        self.lock = threading.Lock()
+        self.matches = []
+        self.cancelled = False
+        self.done = False
+
+    def run(self):
+
+        scrollback = self.scrollback
+        last = scrollback.end_number()
+        while last > scrollback.first_number() and not self.cancelled:
+            first = max(last - BLOCK_LINES,scrollback.first_number())
+            lines = scrollback.numbered_slice(first,last)
+            #The oldest lines may have been dropped meanwhile
+            first = last - len(lines)
+            hits = self.search_block(first,u"\n".join(lines))
+            if hits:
+                with self.lock:
+                    self.matches.extend(hits)
+                self.publish()
+            last = first
+        self.done = True
+        self.publish()
+
+    def search_block(self, first, text):
+
+        #Returns (line number, start col, end col) of each match, newest
+        #first. Line numbers are counted between consecutive matches only.
+        hits = []
+        line = first
+        line_start = 0
+        pos = 0
+        for m in self.pattern.finditer(text):
+            start = m.start()
+            newlines = text.count(u"\n",pos,start)
+            if newlines:
+                line += newlines
+                line_start = text.rfind(u"\n",0,start) + 1
+            pos = start
+            #A match running over several lines is shown on its first
+            end = m.end()
+            eol = text.find(u"\n",start,end)
+            if eol != -1:
+                end = eol
+            hits.append((line,start - line_start,end - line_start))
+        hits.reverse()
+        return hits
+
+    def publish(self):
+
+        if self.notify is not None:
+            self.notify()
+
+    def cancel(self):
+
+        self.cancelled = True
+
+    def count(self):
+
+        with self.lock:
+            return len(self.matches)
+
+    def match(self, i):
+
+        with self.lock:
+            return self.matches[i]
@@ -0,0 +1,125 @@
+import os,pty,fcntl,termios,signal
+from ptyio import PtyReader, PtyChannel, PtyWatcher
+from scrollback import Scrollback
+from terminal import Screen, Terminal
+from recording import Recorder
+
+SCROLLBACK_LINES = 10000
+#Background sessions only keep this much unparsed output
+BACKGROUND_PENDING = 256 << 10
+ACTIVE_PENDING = 4 << 20
+
+def spawn_shell(argv=("/bin/bash",)):
+
+    #Forks argv on a new pty with echo off and returns (pid, fd) with the
+    #fd non blocking
+    pid,fd = pty.fork()
+    if pid == 0:
+        os.environ["TERM"] = "vt100"
+        os.execv(argv[0],list(argv))
+
+    tc_attr = termios.tcgetattr(fd)
+    tc_attr[3] = tc_attr[3] & ~termios.ECHO
+    termios.tcsetattr(fd,termios.TCSANOW,tc_attr)
+    fl = fcntl.fcntl(fd,fcntl.F_GETFL)
+    fcntl.fcntl(fd,fcntl.F_SETFL,fl|os.O_NONBLOCK)
+    return pid,fd
+
+class Session(object):
+
+    #One shell: its pty, the channel its output waits in and the terminal
+    #state it is parsed into. Output is only parsed while the session is
+    #shown; until then it waits, capped, in the channel.
+    def __init__(self, pid, fd, scrollback_lines=SCROLLBACK_LINES):
+
+        self.pid = pid
+        self.fd = fd
+        self.reader = PtyReader(fd)
+        self.channel = PtyChannel(self.reader,max_pending=BACKGROUND_PENDING)
+        self.scrollback = Scrollback(scrollback_lines)
+        self.screen = Screen(on_scroll=self.scrollback.add_line)
+        self.terminal = Terminal(self.screen)
+
+    def record(self, path):
+
+        self.reader.recorder = Recorder(path)
+
+    def close(self):
+
+        if self.reader.recorder is not None:
+            self.reader.recorder.close()
+        try:
+            os.kill(self.pid,signal.SIGHUP)
+            os.waitpid(self.pid,0)
+        except OSError:
+            pass
+        os.close(self.fd)
+
+class SessionManager(object):
+
+    #Owns every session and the single PtyWatcher thread that reads all of
+    #their ptys. Only the active session has a notify callback and a large
+    #pending cap. With record_dir set, each session records its output to
+    #session-<pid>.rec in it.
+    def __init__(self, scrollback_lines=SCROLLBACK_LINES, record_dir=None):
+
+        self.scrollback_lines = scrollback_lines
+        self.record_dir = record_dir
+        self.sessions = []
+        self.active = None
+        self.notify = None
+        self.watcher = PtyWatcher()
+        self.watcher.start()
+
+    def new_session(self, argv=("/bin/bash",)):
+
+        pid,fd = spawn_shell(argv)
+        session = Session(pid,fd,self.scrollback_lines)
+        if self.record_dir is not None:
+            session.record(os.path.join(self.record_dir,"session-%d.rec" % pid))
+        self.sessions.append(session)
+        self.watcher.add(session.channel)
+        if self.active is None:
+            self.activate(session)
+        return session
+
+    def activate(self, session):
+
+        if self.active is not None:
+            self.active.channel.notify = None
+            self.active.channel.max_pending = BACKGROUND_PENDING
+        self.active = session
+        session.channel.max_pending = ACTIVE_PENDING
+        session.channel.notify = self.notify
+        if self.notify is not None and session.channel.has_pending():
+            self.notify()
+
+    def switch(self, step):
+
+        i = self.sessions.index(self.active)
+        self.activate(self.sessions[(i + step) % len(self.sessions)])
+
+    def set_notify(self, notify):
+
+        self.notify = notify
+        if self.active is not None:
+            self.activate(self.active)
+
+    def close(self, session):
+
+        self.watcher.remove(session.channel)
+        session.close()
+        self.sessions.remove(session)
+        if session is self.active:
+            self.active = None
+            if self.sessions:
+                self.activate(self.sessions[-1])
+
+    def stop(self):
+
+        self.watcher.stop()
+        self.watcher.join(1.0)
+        for session in list(self.sessions):
+            self.watcher.remove(session.channel)
+            session.close()
+        self.sessions = []
@@ -1,86 +1,362 @@
-import sip,sys,os,pty,time
+import sip,sys,os,time,re
 from kivy.uix.floatlayout import *
 from kivy.uix.textinput import *
 from kivy.clock import *
 from kivy.app import App
 from kivy.uix.textinput import TextInput
-import select,fcntl,termios
+from kivy.core.text import Label as CoreLabel
+import select,fcntl,termios,struct
 from kivy.properties import *
+from sessions import SessionManager
+from search import ScrollbackSearch
+from history import History
 
 class shellApp(App):
 
-    def __init__(self,return_val,fd):
+    def __init__(self,manager):
         
         App.__init__(self)
-        self.return_val = return_val
-        self.fd = fd
+        self.manager = manager
         
     def build(self):
-        main_window = MainWindow(self.return_val,self.fd)
-        return main_window
+        self.main_window = MainWindow(self.manager)
+        return self.main_window
+
+    def on_stop(self):
+        self.manager.stop()
 
 class ShellTextInput(TextInput):
 
     def __init__(self, **kwargs):
 
         super(ShellTextInput, self).__init__(**kwargs)
+        #Everything before output_len is output, the command being typed
+        #is the text after it
+        self.output_len = 0
+        self.lines_shown = []
+        self.history = History()
+        self.history_pos = None
+        self.history_prefix = ""
+        self.search_text = None
+
+    def get_input(self):
+
+        return self.text[self.output_len:]
+
+    def set_input(self,s):
+
+        self.text = self.text[:self.output_len] + s
+        self.cursor = self.get_cursor_from_index(len(self.text))
         
     def insert_text(self,substring,from_undo=False):
         
+        self.history_pos = None
+        self.search_text = None
         if substring == "\n":
-            row = self.cursor[0]-1
-            full_text = self.text
-            last_row_index = full_text.rfind("\n")
-            if last_row_index == -1:
-                last_row_index = 0
-                
-            last_line_text = full_text[last_row_index:]
-            text_to_write = last_line_text[self.min_pos:].strip()
-            os.write(self.win_parent.fd,text_to_write+'\n')
+            #The command moves into the scrollback, right after the prompt
+            text_to_write = self.get_input().strip()
+            self.win_parent.send(text_to_write+'\n')
+            self.history.add(text_to_write)
+            self.set_input("")
+            self.win_parent.echo(text_to_write+'\n')
+            return
+        if "\n" in substring:
+            #A paste: its complete lines are sent, the rest stays typed
+            text = self.get_input() + substring
+            end = text.rfind("\n") + 1
+            if self.win_parent.send(text[:end]):
+                self.set_input(text[end:])
+                self.win_parent.echo(text[:end])
+            return
+        if self.cursor_index() < self.output_len:
+            self.cursor = self.get_cursor_from_index(len(self.text))
         TextInput.insert_text(self,substring,from_undo)
+
+    def do_backspace(self,from_undo=False,mode='bkspc'):
+
+        if self.cursor_index() <= self.output_len and not self.selection_text:
+            return
+        TextInput.do_backspace(self,from_undo,mode)
+
+    def keyboard_on_key_down(self,window,keycode,text,modifiers):
+
+        key = keycode[1]
+        if key == 'up':
+            self.history_step(-1)
+            return True
+        if key == 'down':
+            self.history_step(1)
+            return True
+        if key == 'r' and 'ctrl' in modifiers:
+            self.history_search()
+            return True
+        if key == 't' and 'ctrl' in modifiers:
+            self.win_parent.new_session()
+            return True
+        if key == 'f' and 'ctrl' in modifiers:
+            #Searches the scrollback for the typed text, as a regex
+            #with shift
+            self.win_parent.start_search(self.get_input(),
+                                         'shift' in modifiers)
+            return True
+        if key == 'f3':
+            self.win_parent.goto_match(-1 if 'shift' in modifiers else 1)
+            return True
+        if key in ('pageup','pagedown') and 'ctrl' in modifiers:
+            self.win_parent.switch_session(-1 if key == 'pageup' else 1)
+            return True
+        return super(ShellTextInput, self).keyboard_on_key_down(
+            window,keycode,text,modifiers)
+
+    def history_step(self,direction):
+
+        #Up and down walk the commands starting with what was typed
+        #before the first step
+        if self.history_pos is None:
+            self.history_prefix = self.get_input()
+            self.history_pos = self.history.end()
+        if direction < 0:
+            found = self.history.previous(self.history_prefix,self.history_pos)
+        else:
+            found = self.history.next(self.history_prefix,self.history_pos)
+        if found is None:
+            if direction > 0:
+                self.history_pos = self.history.end()
+                self.set_input(self.history_prefix)
+            return
+        self.history_pos,command = found
+        self.set_input(command)
+
+    def history_search(self):
+
+        #Ctrl+R finds the newest command containing the typed text, each
+        #further Ctrl+R the next older one
+        if self.search_text is None:
+            self.search_text = self.get_input()
+            self.history_pos = self.history.end()
+        found = self.history.search(self.search_text,self.history_pos)
+        if found is not None:
+            self.history_pos,command = found
+            self.set_input(command)
+
+    def visible_rows(self):
+
+        line = self.line_height + self.line_spacing
+        return max(int((self.height - self.padding[1] - self.padding[3])/line),1)
+
+    def visible_cols(self):
+
+        label = CoreLabel(font_name=self.font_name,font_size=self.font_size)
+        width = label.get_extents('M')[0]
+        return max(int((self.width - self.padding[0] - self.padding[2])/width),1)
+
+    def show(self,lines):
+
+        #Replaces the output part of the text with lines, keeping whatever
+        #the user has typed after it
+        typed = self.get_input()
+        text = "\n".join(lines)
+        self.lines_shown = lines
+        self.output_len = len(text)
+        self.text = text + typed
+        self.cursor = self.get_cursor_from_index(len(self.text))
+
+    def on_touch_down(self,touch):
+
+        if touch.is_mouse_scrolling and self.collide_point(*touch.pos):
+            if touch.button == 'scrolldown':
+                self.win_parent.scroll_by(3)
+            elif touch.button == 'scrollup':
+                self.win_parent.scroll_by(-3)
+            return True
+        return super(ShellTextInput, self).on_touch_down(touch)
         
 class MainWindow(FloatLayout):
 
     textInput = ObjectProperty()
+    frame_budget = NumericProperty(0.008)
+    frame_chars = NumericProperty(65536)
     
-    def __init__(self,return_val,fd,**kwargs):
+    def __init__(self,manager,**kwargs):
             
-        super(MainWindow,self).__init__()
+        super(MainWindow,self).__init__(**kwargs)
 
-        self.fd = fd
+        self.manager = manager
+        self.rows_text = []
+        self.scroll = 0
+        self.search = None
+        self.search_index = -1
+        self.search_trigger = Clock.create_trigger(self.search_progress)
         self.textInput.win_parent = self        
-        Clock.schedule_interval(self.readOutput,0)
+        self.output_trigger = Clock.create_trigger(self.readOutput)
+        self.manager.set_notify(self.output_trigger)
+        self.show_session()
+        self.textInput.bind(size = self.resize)
+
+    def show_session(self):
+
+        #Everything below reads the active session
+        self.stop_search()
+        session = self.manager.active
+        self.session = session
+        self.fd = session.fd
+        self.scrollback = session.scrollback
+        self.screen = session.screen
+        self.terminal = session.terminal
+        self.stats = session.channel.stats
+        self.scroll = 0
+        self.textInput.set_input("")
+        self.resize()
+
+    def new_session(self):
+
+        self.manager.activate(self.manager.new_session())
+        self.show_session()
+
+    def switch_session(self,step):
+
+        self.manager.switch(step)
+        self.show_session()
         
     def readOutput(self,dt):
         
-        r,w,e = select.select([self.fd],[],[],0)
-        s=''
-        d='1'
-        try:                
-            while d != '' and r!=[]:                
-                d = os.read(r[0],1)
-                s+=d
-        except OSError:
-            pass        
-
-        if s!="":
-            s = unicode(s,'utf-8',errors='replace')
-            self.textInput.text += s           
-            self.textInput.min_pos = len(s)         
+        #Appends output in frame_chars steps until frame_budget seconds are
+        #spent, then paints once. Whatever is left waits for the next frame.
+        channel = self.session.channel
+        start = time.time()
+        chars = 0
+        first_stamp = None
+        while time.time() - start < self.frame_budget:
+            s,stamp = channel.take(int(self.frame_chars))
+            if s=="":
+                break
+            if first_stamp is None:
+                first_stamp = stamp
+            self.terminal.feed(s)
+            chars += len(s)
 
-if __name__ == '__main__':
-    
-    return_val = pty.fork()      
+        if chars:
+            self.refresh()
+            self.stats.painted(chars,first_stamp)
+        if channel.has_pending():
+            self.stats.frames_skipped += 1
+            self.output_trigger()
+        elif channel.ended():
+            self.session_ended()
 
-    if return_val[0] == 0:           
-        os.execv("/bin/bash",["/bin/bash"])
-    
-    state = 0
-    fd = return_val[1]
-    tc_attr = termios.tcgetattr(fd)
-    tc_attr[3] = tc_attr[3] & ~termios.ECHO
-    termios.tcsetattr(fd,termios.TCSANOW,tc_attr)
-    fl = fcntl.fcntl(fd,fcntl.F_GETFL)
-    fcntl.fcntl(fd,fcntl.F_SETFL,fl|os.O_NONBLOCK)
+    def session_ended(self):
+
+        self.manager.close(self.session)
+        if self.manager.active is None:
+            App.get_running_app().stop()
+            return
+        self.show_session()
+
+    def echo(self,s):
+
+        #The pty does not echo, so typed commands are drawn here
+        self.terminal.feed(s.replace('\n','\r\n'))
+        self.scroll = 0
+        self.refresh()
+
+    def send(self,s):
+
+        #Queued, the watcher thread writes it as the pty accepts it.
+        #False if the write queue is full.
+        return self.session.channel.send(s.encode('utf-8'))
+
+    def start_search(self,pattern,regex=False):
+
+        self.stop_search()
+        if pattern == "":
+            return
+        try:
+            self.search = ScrollbackSearch(self.scrollback,pattern,regex,
+                                           notify=self.search_trigger)
+        except re.error:
+            return
+        self.search.start()
+
+    def stop_search(self):
+
+        if self.search is not None:
+            self.search.cancel()
+        self.search = None
+        self.search_index = -1
+
+    def search_progress(self,dt):
+
+        #Jumps to the newest match as soon as the worker finds it
+        if self.search is not None and self.search_index == -1:
+            self.goto_match(1)
+
+    def goto_match(self,step):
+
+        #step 1 goes to the next older match, -1 to the next newer one
+        search = self.search
+        if search is None:
+            return
+        i = self.search_index + step
+        if i < 0 or i >= search.count():
+            return
+        self.search_index = i
+        number,start,end = search.match(i)
+        pos = number - self.scrollback.first_number()
+        if pos < 0:
+            return
+
+        rows = self.textInput.visible_rows()
+        total = len(self.scrollback) + len(self.screen_lines())
+        last = min(total,pos + rows//2 + 1)
+        self.scroll = total - last
+        self.refresh()
+        first = max(last - rows,0)
+        lines = self.textInput.lines_shown
+        offset = sum(len(line) + 1 for line in lines[:pos - first])
+        self.textInput.select_text(offset + start,offset + end)
+
+    def scroll_by(self,lines):
+
+        self.scroll = max(min(self.scroll + lines,len(self.scrollback)),0)
+        self.refresh()
+
+    def resize(self,*args):
+
+        rows = self.textInput.visible_rows()
+        cols = self.textInput.visible_cols()
+        self.screen.resize(rows,cols)
+        self.screen.dirty.update(range(0,rows))
+        self.rows_text = [""]*rows
+        fcntl.ioctl(self.fd,termios.TIOCSWINSZ,
+                    struct.pack('HHHH',rows,cols,0,0))
+        self.refresh()
+
+    def refresh(self,*args):
+
+        #Only the visible lines are ever handed to the TextInput, and only
+        #the screen rows that changed are turned back into strings
+        rows = self.textInput.visible_rows()
+        self.textInput.show(self.scrollback.window(rows,self.scroll,
+                                                   self.screen_lines()))
+
+    def screen_lines(self):
+
+        screen = self.screen
+        for y in screen.take_dirty():
+            self.rows_text[y] = screen.row_text(y)
+        used = screen.rows
+        if screen.alt is None:
+            #Blank rows below the cursor are not shown
+            used = screen.y + 1
+            for y in range(screen.rows - 1,screen.y,-1):
+                if self.rows_text[y]:
+                    used = y + 1
+                    break
+        return self.rows_text[:used]
+
+if __name__ == '__main__':
     
-    shellApp(return_val,fd).run()
+    #KIVYSHELL_RECORD=<dir> records every session, see recording.py
+    manager = SessionManager(record_dir=os.environ.get("KIVYSHELL_RECORD"))
+    manager.new_session()
+    shellApp(manager).run()
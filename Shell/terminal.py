@@ -0,0 +1,627 @@
+import re
+from array import array
+
+#Cell attributes are packed in one int: fg color in bits 0-4, bg color in
+#bits 5-9 (16 is the default color of both) and the flags above them.
+FG_DEFAULT = 16
+BG_DEFAULT = 16
+BOLD = 1 << 10
+UNDERLINE = 1 << 11
+REVERSE = 1 << 12
+DEFAULT_ATTR = FG_DEFAULT | BG_DEFAULT << 5
+FG_MASK = 0x1f
+BG_MASK = 0x1f << 5
+
+#One token per match: a run of printable text (with the line end after
+#it, if any), a CSI sequence, an OSC string, a charset designation, a two
+#char escape or a control char. The only input that does not match is an
+#escape sequence cut by the end of a chunk.
+TOKEN = re.compile(u'([^\x00-\x1f\x1b\x7f]+)(\r\n)?'
+                   u'|\x1b\\[([0-?]*)[ -/]*([@-~])'
+                   u'|\x1b\\][^\x07\x1b]*(?:\x07|\x1b\\\\)'
+                   u'|\x1b[()*+#%].'
+                   u'|\x1b([^\\[\\]()*+#%])'
+                   u'|([\x00-\x1a\x1c-\x1f\x7f])',re.S)
+MAX_TAIL = 1024
+#A run of whole lines of plain text, none wider than the screen
+PLAIN_LINES = u'(?:[^\x00-\x1f\x1b\x7f]{0,%d}\r\n)+'
+#A run of whole lines of text, color changes and erases to the end of
+#the line, as from ls or grep --color, written so that a long line without
+#an end cannot make it backtrack. On a line being drawn from the start of
+#a blank row such an erase has nothing to erase.
+COLOR_LINES = re.compile(u'(?:[^\x00-\x1f\x1b\x7f]*'
+                         u'(?:\x1b\\[(?:[0-9;]*m|0?K)'
+                         u'[^\x00-\x1f\x1b\x7f]*)*\r\n)+')
+#Either, with the params of a color change
+CHANGE = re.compile(u'\x1b\\[(?:([0-9;]*)m|0?K)')
+SGR = re.compile(u'\x1b\\[([0-9;]*)m')
+
+class Screen(object):
+
+    #rows x cols cells. chars[y] is a list of one char strings and
+    #attrs[y] an array of packed attributes. Every row that changes is
+    #added to dirty; lines scrolled off the top of the main screen are
+    #passed to on_scroll.
+    def __init__(self, rows=24, cols=80, on_scroll=None):
+
+        self.rows = rows
+        self.cols = cols
+        self.on_scroll = on_scroll
+        self.attr = DEFAULT_ATTR
+        self.saved = (0,0,DEFAULT_ATTR)
+        self.alt = None
+        self.cursor_visible = True
+        self.autowrap = True
+        self.chars = [self.blank_chars() for y in range(0,rows)]
+        self.attrs = [self.blank_attrs() for y in range(0,rows)]
+        self.x = 0
+        self.y = 0
+        self.wrap_pending = False
+        self.top = 0
+        self.bottom = rows - 1
+        self.dirty = set(range(0,rows))
+
+    def blank_chars(self, n=None):
+
+        return [u' ']*(self.cols if n is None else n)
+
+    def blank_attrs(self, n=None):
+
+        return array('I',[DEFAULT_ATTR])*(self.cols if n is None else n)
+
+    def take_dirty(self):
+
+        dirty = self.dirty
+        self.dirty = set()
+        return dirty
+
+    def row_text(self, y):
+
+        return u"".join(self.chars[y]).rstrip()
+
+    def resize(self, rows, cols):
+
+        if rows == self.rows and cols == self.cols:
+            return
+        #Keep the bottom of the screen, where the cursor usually is
+        shift = max(self.y + 1 - rows,0)
+        for y in range(0,shift):
+            self.scrolled_off(y)
+        chars = self.chars[shift:shift + rows]
+        attrs = self.attrs[shift:shift + rows]
+        self.cols = cols
+        for y in range(0,len(chars)):
+            chars[y] = (chars[y] + self.blank_chars())[:cols]
+            attrs[y] = (attrs[y] + self.blank_attrs())[:cols]
+        while len(chars) < rows:
+            chars.append(self.blank_chars())
+            attrs.append(self.blank_attrs())
+        self.chars = chars
+        self.attrs = attrs
+        self.rows = rows
+        self.y -= shift
+        self.x = min(self.x,cols - 1)
+        self.top = 0
+        self.bottom = rows - 1
+        self.wrap_pending = False
+        self.dirty = set(range(0,rows))
+
+    def draw(self, text):
+
+        attr = self.attr
+        cols = self.cols
+        pos = 0
+        end = len(text)
+        while pos < end:
+            if self.wrap_pending:
+                self.wrap_pending = False
+                if not self.autowrap:
+                    break
+                self.x = 0
+                self.linefeed()
+            x = self.x
+            k = min(cols - x,end - pos)
+            self.chars[self.y][x:x + k] = text[pos:pos + k]
+            if attr == DEFAULT_ATTR and k == cols:
+                self.attrs[self.y] = self.blank_attrs()
+            else:
+                self.attrs[self.y][x:x + k] = array('I',[attr])*k
+            self.dirty.add(self.y)
+            pos += k
+            if x + k >= cols:
+                self.x = cols - 1
+                self.wrap_pending = True
+            else:
+                self.x = x + k
+
+    def streaming(self):
+
+        #True when the cursor sits at the start of a blank last row of a
+        #plain full screen, the state of a shell printing lots of output
+        return (self.x == 0 and self.y == self.rows - 1 and self.top == 0 and
+                self.bottom == self.y and self.alt is None and
+                not self.wrap_pending and self.chars[-1] == self.blank_chars())
+
+    def push_lines(self, lines, line_attrs=None):
+
+        #Same as drawing each line followed by \r\n in the streaming state,
+        #but lines that would scroll off at once never touch the grid.
+        #line_attrs are the attributes of the last rows - 1 lines, all
+        #default if None.
+        n = len(lines)
+        keep = self.rows - 1
+        on_scroll = self.on_scroll
+        if on_scroll is not None:
+            for y in range(0,min(n,keep)):
+                on_scroll(self.row_text(y))
+            for line in lines[:max(n - keep,0)]:
+                on_scroll(line.rstrip())
+        cols = self.cols
+        chars = [list(line.ljust(cols)) for line in lines[-keep:]]
+        if line_attrs is None:
+            attrs = [self.blank_attrs() for line in chars]
+        else:
+            attrs = line_attrs
+        if n < keep:
+            chars = self.chars[n:keep] + chars
+            attrs = self.attrs[n:keep] + attrs
+        chars.append(self.blank_chars())
+        attrs.append(self.blank_attrs())
+        self.chars = chars
+        self.attrs = attrs
+        self.dirty.update(range(0,self.rows))
+
+    def scrolled_off(self, y):
+
+        if self.on_scroll is not None and self.alt is None:
+            self.on_scroll(self.row_text(y))
+
+    def scroll_up(self, n=1):
+
+        top = self.top
+        bottom = self.bottom
+        n = min(n,bottom - top + 1)
+        if top == 0:
+            for y in range(0,n):
+                self.scrolled_off(y)
+        if n == 1 and top == 0 and bottom == self.rows - 1:
+            self.chars.pop(0)
+            self.attrs.pop(0)
+            self.chars.append(self.blank_chars())
+            self.attrs.append(self.blank_attrs())
+            if len(self.dirty) < self.rows:
+                self.dirty.update(range(0,self.rows))
+            return
+        del self.chars[top:top + n]
+        del self.attrs[top:top + n]
+        for i in range(0,n):
+            self.chars.insert(bottom - n + 1 + i,self.blank_chars())
+            self.attrs.insert(bottom - n + 1 + i,self.blank_attrs())
+        self.dirty.update(range(top,bottom + 1))
+
+    def scroll_down(self, n=1):
+
+        top = self.top
+        bottom = self.bottom
+        n = min(n,bottom - top + 1)
+        del self.chars[bottom - n + 1:bottom + 1]
+        del self.attrs[bottom - n + 1:bottom + 1]
+        for i in range(0,n):
+            self.chars.insert(top,self.blank_chars())
+            self.attrs.insert(top,self.blank_attrs())
+        self.dirty.update(range(top,bottom + 1))
+
+    def linefeed(self):
+
+        self.wrap_pending = False
+        if self.y == self.bottom:
+            self.scroll_up()
+        elif self.y < self.rows - 1:
+            self.y += 1
+
+    def reverse_index(self):
+
+        self.wrap_pending = False
+        if self.y == self.top:
+            self.scroll_down()
+        elif self.y > 0:
+            self.y -= 1
+
+    def move_to(self, y, x):
+
+        self.wrap_pending = False
+        self.y = max(min(y,self.rows - 1),0)
+        self.x = max(min(x,self.cols - 1),0)
+
+    def erase(self, y, first, last):
+
+        self.chars[y][first:last] = self.blank_chars(last - first)
+        self.attrs[y][first:last] = self.blank_attrs(last - first)
+        self.dirty.add(y)
+
+    def erase_line(self, mode):
+
+        if mode == 0:
+            self.erase(self.y,self.x,self.cols)
+        elif mode == 1:
+            self.erase(self.y,0,self.x + 1)
+        else:
+            self.erase(self.y,0,self.cols)
+
+    def erase_display(self, mode):
+
+        if mode == 0:
+            self.erase_line(0)
+            rows = range(self.y + 1,self.rows)
+        elif mode == 1:
+            self.erase_line(1)
+            rows = range(0,self.y)
+        else:
+            rows = range(0,self.rows)
+        for y in rows:
+            self.erase(y,0,self.cols)
+
+    def insert_lines(self, n):
+
+        if self.top <= self.y <= self.bottom:
+            top = self.top
+            self.top = self.y
+            self.scroll_down(n)
+            self.top = top
+
+    def delete_lines(self, n):
+
+        if self.top <= self.y <= self.bottom:
+            top = self.top
+            self.top = self.y
+            self.scroll_up_quiet(n)
+            self.top = top
+
+    def scroll_up_quiet(self, n):
+
+        on_scroll = self.on_scroll
+        self.on_scroll = None
+        self.scroll_up(n)
+        self.on_scroll = on_scroll
+
+    def insert_chars(self, n):
+
+        row = self.chars[self.y]
+        attrs = self.attrs[self.y]
+        n = min(n,self.cols - self.x)
+        row[self.x:self.x] = self.blank_chars(n)
+        attrs[self.x:self.x] = self.blank_attrs(n)
+        del row[self.cols:]
+        del attrs[self.cols:]
+        self.dirty.add(self.y)
+
+    def delete_chars(self, n):
+
+        row = self.chars[self.y]
+        attrs = self.attrs[self.y]
+        n = min(n,self.cols - self.x)
+        del row[self.x:self.x + n]
+        del attrs[self.x:self.x + n]
+        row.extend(self.blank_chars(n))
+        attrs.extend(self.blank_attrs(n))
+        self.dirty.add(self.y)
+
+    def set_region(self, top, bottom):
+
+        if 0 <= top < bottom < self.rows:
+            self.top = top
+            self.bottom = bottom
+            self.move_to(0,0)
+
+    def save_cursor(self):
+
+        self.saved = (self.y,self.x,self.attr)
+
+    def restore_cursor(self):
+
+        y,x,self.attr = self.saved
+        self.move_to(y,x)
+
+    def set_alternate(self, on):
+
+        if on and self.alt is None:
+            self.save_cursor()
+            self.alt = (self.chars,self.attrs)
+            self.chars = [self.blank_chars() for y in range(0,self.rows)]
+            self.attrs = [self.blank_attrs() for y in range(0,self.rows)]
+        elif not on and self.alt is not None:
+            chars,attrs = self.alt
+            self.alt = None
+            #The main screen may have been saved at another size
+            self.chars = [(row + self.blank_chars())[:self.cols]
+                          for row in chars[:self.rows]]
+            self.attrs = [(row + self.blank_attrs())[:self.cols]
+                          for row in attrs[:self.rows]]
+            while len(self.chars) < self.rows:
+                self.chars.append(self.blank_chars())
+                self.attrs.append(self.blank_attrs())
+            self.restore_cursor()
+        self.dirty = set(range(0,self.rows))
+
+    def select_graphic_rendition(self, params):
+
+        attr = self.attr
+        i = 0
+        if not params:
+            params = [0]
+        while i < len(params):
+            p = params[i]
+            if p == 0:
+                attr = DEFAULT_ATTR
+            elif p == 1:
+                attr |= BOLD
+            elif p == 4:
+                attr |= UNDERLINE
+            elif p == 7:
+                attr |= REVERSE
+            elif p == 22:
+                attr &= ~BOLD
+            elif p == 24:
+                attr &= ~UNDERLINE
+            elif p == 27:
+                attr &= ~REVERSE
+            elif 30 <= p <= 37:
+                attr = attr & ~FG_MASK | (p - 30)
+            elif 90 <= p <= 97:
+                attr = attr & ~FG_MASK | (p - 82)
+            elif p == 39:
+                attr = attr & ~FG_MASK | FG_DEFAULT
+            elif 40 <= p <= 47:
+                attr = attr & ~BG_MASK | (p - 40) << 5
+            elif 100 <= p <= 107:
+                attr = attr & ~BG_MASK | (p - 92) << 5
+            elif p == 49:
+                attr = attr & ~BG_MASK | BG_DEFAULT << 5
+            elif p in (38,48) and i + 2 < len(params) and params[i + 1] == 5:
+                #256 color palette, only the 16 base colors are kept
+                c = params[i + 2]
+                if c < 16:
+                    if p == 38:
+                        attr = attr & ~FG_MASK | c
+                    else:
+                        attr = attr & ~BG_MASK | c << 5
+                i += 2
+            elif p in (38,48) and i + 4 < len(params) and params[i + 1] == 2:
+                i += 4
+            i += 1
+        self.attr = attr
+
+class Terminal(object):
+
+    #Streaming VT100/xterm parser. feed() takes decoded text in chunks of
+    #any size and applies it to screen; an escape sequence split between
+    #two chunks is kept in tail until the rest arrives.
+    def __init__(self, screen):
+
+        self.screen = screen
+        self.tail = u""
+        self.sgr_cache = {}
+        self.plain_lines = {}
+
+    def feed(self, data):
+
+        if self.tail:
+            data = self.tail + data
+            self.tail = u""
+        screen = self.screen
+        match = TOKEN.match
+        pos = 0
+        end = len(data)
+        while pos < end:
+            m = match(data,pos)
+            if m is None:
+                if end - pos > MAX_TAIL:
+                    #Not a sequence we will ever complete, skip the escape
+                    pos += 1
+                    continue
+                self.tail = data[pos:]
+                return
+            pos = m.end()
+            text,crlf,params,final,esc,control = m.group(1,2,3,4,5,6)
+            if text is not None:
+                screen.draw(text)
+                if crlf is not None:
+                    screen.x = 0
+                    screen.linefeed()
+                    if screen.streaming():
+                        pos = self.push_lines(data,pos)
+            elif control is not None:
+                self.control(control)
+            elif final is not None:
+                self.csi(params,final)
+            elif esc is not None:
+                self.escape(esc)
+
+    def sgr(self, attr, params):
+
+        #attr after the color change params. Color changes are most of the
+        #sequences in colored output, and the same few over and over.
+        key = (attr,params)
+        new = self.sgr_cache.get(key)
+        if new is None:
+            screen = self.screen
+            old = screen.attr
+            screen.attr = attr
+            screen.select_graphic_rendition([int(p) if p.isdigit() else 0
+                                             for p in params.split(u';')]
+                                            if params else [])
+            new = screen.attr
+            screen.attr = old
+            if len(self.sgr_cache) < 4096:
+                self.sgr_cache[key] = new
+        return new
+
+    def push_lines(self, data, pos):
+
+        screen = self.screen
+        cols = screen.cols
+        if screen.attr == DEFAULT_ATTR:
+            pattern = self.plain_lines.get(cols)
+            if pattern is None:
+                pattern = re.compile(PLAIN_LINES % cols)
+                self.plain_lines[cols] = pattern
+            m = pattern.match(data,pos)
+            if m is not None:
+                lines = m.group().split(u'\r\n')
+                lines.pop()
+                screen.push_lines(lines)
+                pos = m.end()
+        return self.push_color_lines(data,pos)
+
+    def push_color_lines(self, data, pos):
+
+        #Lines of text and color changes, up to the first wider than the
+        #screen. Their text and the lines that scroll off at once are dealt
+        #with by the regex engine; only the rows left on screen are walked
+        #change by change for their attributes.
+        m = COLOR_LINES.match(data,pos)
+        if m is None:
+            return pos
+        screen = self.screen
+        cols = screen.cols
+        lines = m.group().split(u'\r\n')
+        lines.pop()
+        texts = CHANGE.sub(u"",m.group()).split(u'\r\n')
+        texts.pop()
+        if max(map(len,texts)) > cols:
+            n = next(i for i,text in enumerate(texts) if len(text) > cols)
+            if n == 0:
+                return pos
+            del lines[n:],texts[n:]
+        n = len(lines)
+        first = max(n - (screen.rows - 1),0)
+        mid = pos + sum(map(len,lines[:first])) + 2*first
+        attr = self.sgr_all(screen.attr,data,pos,mid)
+        rows = []
+        for line in lines[first:]:
+            parts = CHANGE.split(line)
+            row = array('I',[attr])*len(parts[0])
+            for j in range(1,len(parts),2):
+                if parts[j] is not None:
+                    attr = self.sgr(attr,parts[j])
+                row.extend(array('I',[attr])*len(parts[j + 1]))
+            row.extend(screen.blank_attrs(cols - len(row)))
+            rows.append(row)
+        screen.push_lines(texts,rows)
+        screen.attr = attr
+        return mid + sum(map(len,lines[first:])) + 2*(n - first)
+
+    def sgr_all(self, attr, data, start, end):
+
+        #attr after every color change in data[start:end]. Those before the
+        #last plain reset make no difference.
+        reset = max(data.rfind(u'\x1b[0m',start,end),
+                    data.rfind(u'\x1b[m',start,end))
+        if reset != -1:
+            attr = DEFAULT_ATTR
+            start = reset
+        for params in SGR.findall(data,start,end):
+            attr = self.sgr(attr,params)
+        return attr
+
+    def control(self, c):
+
+        screen = self.screen
+        if c == u'\r':
+            screen.x = 0
+            screen.wrap_pending = False
+        elif c in u'\n\x0b\x0c':
+            screen.linefeed()
+        elif c == u'\b':
+            screen.move_to(screen.y,screen.x - 1)
+        elif c == u'\t':
+            screen.move_to(screen.y,(screen.x//8 + 1)*8)
+
+    def escape(self, c):
+
+        screen = self.screen
+        if c == u'7':
+            screen.save_cursor()
+        elif c == u'8':
+            screen.restore_cursor()
+        elif c == u'D':
+            screen.linefeed()
+        elif c == u'E':
+            screen.x = 0
+            screen.linefeed()
+        elif c == u'M':
+            screen.reverse_index()
+        elif c == u'c':
+            screen.attr = DEFAULT_ATTR
+            screen.set_region(0,screen.rows - 1)
+            screen.erase_display(2)
+
+    def csi(self, params, final):
+
+        screen = self.screen
+        if final == u'm':
+            screen.attr = self.sgr(screen.attr,params)
+            return
+
+        private = params[:1] in (u'?',u'>',u'=',u'<')
+        if private:
+            params = params[1:]
+        args = [int(p) if p.isdigit() else 0 for p in params.split(u';')]
+        n = args[0] or 1
+
+        if private:
+            if final in u'hl':
+                on = final == u'h'
+                for mode in args:
+                    if mode in (47,1047,1049):
+                        screen.set_alternate(on)
+                    elif mode == 25:
+                        screen.cursor_visible = on
+                    elif mode == 7:
+                        screen.autowrap = on
+            return
+
+        if final == u'A':
+            screen.move_to(screen.y - n,screen.x)
+        elif final == u'B' or final == u'e':
+            screen.move_to(screen.y + n,screen.x)
+        elif final == u'C' or final == u'a':
+            screen.move_to(screen.y,screen.x + n)
+        elif final == u'D':
+            screen.move_to(screen.y,screen.x - n)
+        elif final == u'E':
+            screen.move_to(screen.y + n,0)
+        elif final == u'F':
+            screen.move_to(screen.y - n,0)
+        elif final == u'G' or final == u'`':
+            screen.move_to(screen.y,n - 1)
+        elif final == u'd':
+            screen.move_to(n - 1,screen.x)
+        elif final == u'H' or final == u'f':
+            col = args[1] if len(args) > 1 and args[1] else 1
+            screen.move_to(n - 1,col - 1)
+        elif final == u'J':
+            screen.erase_display(args[0])
+        elif final == u'K':
+            screen.erase_line(args[0])
+        elif final == u'L':
+            screen.insert_lines(n)
+        elif final == u'M':
+            screen.delete_lines(n)
+        elif final == u'@':
+            screen.insert_chars(n)
+        elif final == u'P':
+            screen.delete_chars(n)
+        elif final == u'X':
+            screen.erase(screen.y,screen.x,min(screen.x + n,screen.cols))
+        elif final == u'S':
+            screen.scroll_up_quiet(n)
+        elif final == u'T':
+            screen.scroll_down(n)
+        elif final == u'r':
+            bottom = args[1] if len(args) > 1 and args[1] else screen.rows
+            screen.set_region((args[0] or 1) - 1,bottom - 1)
+        elif final == u's':
+            screen.save_cursor()
+        elif final == u'u':
+            screen.restore_cursor()
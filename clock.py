@@ -4,7 +4,9 @@ from kivy.uix.floatlayout import FloatLayout
 from kivy.lang import Builder
 from kivy.clock import Clock
 from kivy.graphics import *
+from kivy.properties import BooleanProperty, NumericProperty
 from kivy.app import App
+import clock_geometry
 
 class ClockApp(App):
 
@@ -16,70 +18,133 @@ class ClockApp(App):
         main_window = MainWindow()
         return main_window
     
+class Ticker(object):
+
+    #Calls callback(t) right after every multiple of resolution seconds,
+    #or on every frame in smooth mode. Each wake up is computed from the
+    #wall clock, so scheduling errors never accumulate.
+    def __init__(self, callback, resolution=1.0, smooth=False):
+
+        self.callback = callback
+        self.resolution = resolution
+        self.smooth = smooth
+        self.target = None
+        self.event = None
+
+    def start(self):
+
+        self.stop()
+        if self.smooth:
+            self.event = Clock.schedule_interval(self.tick,0)
+        else:
+            self.schedule(time.time())
+
+    def stop(self):
+
+        if self.event is not None:
+            self.event.cancel()
+            self.event = None
+
+    def schedule(self, now):
+
+        self.target = (math.floor(now/self.resolution) + 1)*self.resolution
+        self.event = Clock.schedule_once(self.tick,self.target - now)
+
+    def tick(self, *args):
+
+        now = time.time()
+        if self.smooth:
+            self.callback(now)
+            return
+
+        #Kivy may wake us a few ms early, never report a time before the
+        #boundary we asked for
+        now = max(now,self.target)
+        self.callback(now)
+        self.schedule(now)
+
+def hand_angles(t, resolution=1.0, smooth=False, convert=time.localtime):
+
+    #All three angles come from a single time read
+    lt = convert(t)
+    frac = t - math.floor(t)
+    if not smooth:
+        frac = math.floor(frac/resolution)*resolution
+    sec = lt.tm_sec + frac
+    mins = lt.tm_min
+    hr = lt.tm_hour % 12
+    if smooth:
+        mins = mins + sec/60.0
+        hr = hr + mins/60.0
+    return (math.radians(sec*6),math.radians(mins*6),math.radians(hr*30))
+
 class MainWindow (FloatLayout):
 
+    smooth = BooleanProperty(False)
+    resolution = NumericProperty(1.0)
+
     def __init__(self, **kwargs):
 
         super(MainWindow, self).__init__(**kwargs)
 
-        Clock.schedule_interval(self.update_clock,0)
+        self.dial = InstructionGroup()
+        self.canvas.add(self.dial)
+        with self.canvas:
+            Color(0.7,0.5,0.4)
+            self.sec_line = Line(points=[],width = 1)
+            self.min_line = Line(points=[],width = 2)
+            self.hr_line = Line(points=[],width = 3)
+
         self.bind(pos = self.update_rect)
         self.bind(size = self.update_rect)
-        self.sec_line = None
-        self.min_line = None
-        self.hr_line = None
+        self.ticker = Ticker(self.update_clock,self.resolution,self.smooth)
+        self.bind(smooth = self.restart_ticker)
+        self.bind(resolution = self.restart_ticker)
         self.update_rect()
+        self.ticker.start()
+
+    def restart_ticker (self, *args):
+
+        self.ticker.smooth = self.smooth
+        self.ticker.resolution = self.resolution
+        self.ticker.start()
                     
     def update_rect (self, *args):
 
-        radius = self.height/2
-        if self.width <= self.height:
-            radius = self.width/2
-        self.sec_radius = radius - 10
-        self.min_radius = radius - 30
-        self.hr_radius = radius - 50
-        self.center_x = self.width/2
-        self.center_y = self.height/2
-        
-    def update_clock (self, *args):
-
-        self.canvas.clear()
-        str_time = time.strftime("%H:%M:%S")
-        sec_angle = math.radians(int(time.strftime("%S"))*6)
-        min_angle = math.radians(int(time.strftime("%M"))*6)
-        hr = int(time.strftime("%H"))        
-        if hr > 12:
-            hr = hr - 12
+        self.geometry = clock_geometry.dial(self.width,self.height)
+        self.sec_radius = self.geometry.sec_radius
+        self.min_radius = self.geometry.min_radius
+        self.hr_radius = self.geometry.hr_radius
+        self.center_x = self.geometry.center_x
+        self.center_y = self.geometry.center_y
+        self.build_dial()
+        self.update_clock()
+
+    def build_dial (self):
+
+        #The dial only depends on the size, so it is rebuilt here and
+        #not on every tick. All ticks of a color go in a single Mesh.
+        self.dial.clear()
+        vertices,indices = self.geometry.major_mesh
+        self.dial.add(Color(1,0,0))
+        self.dial.add(Mesh(vertices=vertices,indices=indices,
+                           mode='triangles'))
+        vertices,indices = self.geometry.minor_mesh
+        self.dial.add(Color(0,1,0))
+        self.dial.add(Mesh(vertices=vertices,indices=indices,
+                           mode='triangles'))
         
-        hr_angle = math.radians(int(hr)*30)        
-                
-        with self.canvas:
-            
-            for i in range (0,60):
-                i_radians = math.radians(i*6)
-                if i%5 == 0:
-                    Color(1,0,0)
-                    Line(circle=(self.center_x + self.sec_radius*math.sin(i_radians),
-                                 self.center_y + self.sec_radius*math.cos(i_radians),
-                                 2,0,359),width = 2)
-                else:
-                    Color(0,1,0)
-                    Line(circle=(self.center_x + self.sec_radius*math.sin(i_radians),
-                                 self.center_y + self.sec_radius*math.cos(i_radians),
-                                 1,0,359),width = 1.5)
-            Color(0.7,0.5,0.4)
-            self.sec_line = Line(points=[self.center_x,self.center_y,
-                                         self.center_x + self.sec_radius*math.sin(sec_angle),
-                                         self.center_y+ self.sec_radius*math.cos(sec_angle)],
-                                 width = 1)
-            self.min_line = Line(points=[self.center_x,self.center_y,
-                                         self.center_x + self.min_radius*math.sin(min_angle),
-                                         self.center_y+ self.min_radius*math.cos(min_angle)],
-                                 width = 2)
-            self.hr_line = Line(points=[self.center_x,self.center_y,
-                                        self.center_x + self.hr_radius*math.sin(hr_angle),
-                                        self.center_y+ self.hr_radius*math.cos(hr_angle)],
-                                width = 3)        
+    def update_clock (self, t=None):
+
+        if t is None:
+            t = time.time()
+        sec_angle,min_angle,hr_angle = hand_angles(t,self.resolution,
+                                                   self.smooth)
+
+        geometry = self.geometry
+        self.sec_line.points = geometry.hand_points(self.sec_radius,sec_angle)
+        self.min_line.points = geometry.hand_points(self.min_radius,min_angle)
+        self.hr_line.points = geometry.hand_points(self.hr_radius,hr_angle)
 
 if __name__ == '__main__':
     ClockApp().run()
@@ -0,0 +1,184 @@
+import math,timeit
+from collections import OrderedDict
+
+#Geometry of the clock face. Nothing in here touches Kivy, so it can be
+#imported and timed without a window.
+
+TICKS = 60
+DOT_SEGMENTS = 8
+CACHE_SIZE = 8
+
+#Unit vectors of the 60 tick marks, 0 is at 12 o'clock going clockwise
+TICK_UNITS = [(math.sin(math.radians(i*6)),math.cos(math.radians(i*6)))
+              for i in range(0,TICKS)]
+DOT_UNITS = [(math.cos(2*math.pi*k/DOT_SEGMENTS),
+              math.sin(2*math.pi*k/DOT_SEGMENTS))
+             for k in range(0,DOT_SEGMENTS)]
+
+class Dial(object):
+
+    def __init__(self, width, height, x=0, y=0):
+
+        radius = min(width,height)/2.0
+        #Small dials, as on the dashboard, shrink the margins with them
+        self.scale = min(1.0,radius/100.0)
+        self.center_x = x + width/2.0
+        self.center_y = y + height/2.0
+        self.sec_radius = radius - 10*self.scale
+        self.min_radius = radius - 30*self.scale
+        self.hr_radius = radius - 50*self.scale
+
+        self.major = []
+        self.minor = []
+        for i in range(0,TICKS):
+            ux,uy = TICK_UNITS[i]
+            pos = (self.center_x + self.sec_radius*ux,
+                   self.center_y + self.sec_radius*uy)
+            if i%5 == 0:
+                self.major.append(pos)
+            else:
+                self.minor.append(pos)
+
+        self.major_mesh = dots_mesh(self.major,3*self.scale)
+        self.minor_mesh = dots_mesh(self.minor,1.75*self.scale)
+
+    def hand_points(self, radius, angle):
+
+        return [self.center_x,self.center_y,
+                self.center_x + radius*math.sin(angle),
+                self.center_y + radius*math.cos(angle)]
+
+    def hand_quad(self, vertices, offset, radius, angle, width):
+
+        #Writes the 4 vertices of a hand drawn as a thin quad
+        s = math.sin(angle)
+        c = math.cos(angle)
+        hw = width*self.scale/2.0
+        nx = c*hw
+        ny = -s*hw
+        x0 = self.center_x
+        y0 = self.center_y
+        x1 = x0 + radius*s
+        y1 = y0 + radius*c
+        vertices[offset:offset + 16] = [x0 + nx,y0 + ny,0,0,
+                                        x1 + nx,y1 + ny,0,0,
+                                        x1 - nx,y1 - ny,0,0,
+                                        x0 - nx,y0 - ny,0,0]
+
+def dots_mesh(centers, radius):
+
+    #Returns (vertices, indices) for a 'triangles' Mesh holding one filled
+    #polygon per center. Vertices use Kivy's default x,y,u,v format.
+    vertices = []
+    indices = []
+    offsets = [(radius*dx,radius*dy) for dx,dy in DOT_UNITS]
+    for x,y in centers:
+        base = len(vertices)//4
+        vertices.extend((x,y,0,0))
+        for dx,dy in offsets:
+            vertices.extend((x + dx,y + dy,0,0))
+        for k in range(0,DOT_SEGMENTS):
+            indices.extend((base,base + 1 + k,
+                            base + 1 + (k + 1)%DOT_SEGMENTS))
+    return vertices,indices
+
+class DialCache(object):
+
+    def __init__(self, size=CACHE_SIZE):
+
+        self.size = size
+        self.dials = OrderedDict()
+
+    def get(self, width, height):
+
+        key = (width,height)
+        dial = self.dials.pop(key,None)
+        if dial is None:
+            dial = Dial(width,height)
+            if len(self.dials) >= self.size:
+                self.dials.popitem(last=False)
+        self.dials[key] = dial
+        return dial
+
+_cache = DialCache()
+
+def dial(width, height):
+
+    return _cache.get(width,height)
+
+HAND_WIDTHS = (1,2,3)
+DASHBOARD_BATCH = 64
+
+class DashboardBatch(object):
+
+    #Up to DASHBOARD_BATCH dials sharing three Meshes: major ticks, minor
+    #ticks and hands. The batch size keeps indices below 65536.
+    def __init__(self, dials):
+
+        self.dials = dials
+        major = []
+        minor = []
+        for d in dials:
+            major.extend(d.major)
+            minor.extend(d.minor)
+        self.major_mesh = dots_mesh(major,3*dials[0].scale)
+        self.minor_mesh = dots_mesh(minor,1.75*dials[0].scale)
+
+        self.hand_vertices = [0.0]*(len(dials)*3*16)
+        self.hand_indices = []
+        for q in range(0,len(dials)*3):
+            b = q*4
+            self.hand_indices.extend((b,b + 1,b + 2,b,b + 2,b + 3))
+
+class Dashboard(object):
+
+    def __init__(self, count, width, height, x=0, y=0,
+                 batch=DASHBOARD_BATCH):
+
+        self.cols = max(1,int(math.ceil(math.sqrt(count*width/
+                                                  float(height)))))
+        self.rows = int(math.ceil(count/float(self.cols)))
+        cell = min(width/float(self.cols),height/float(self.rows))
+        dials = []
+        for i in range(0,count):
+            row,col = divmod(i,self.cols)
+            dials.append(Dial(cell,cell,x + col*cell,
+                              y + height - (row + 1)*cell))
+        self.dials = dials
+        self.batch = batch
+        self.batches = [DashboardBatch(dials[i:i + batch])
+                        for i in range(0,count,batch)]
+        self.angles = [None]*count
+
+    def update(self, angles):
+
+        #angles[i] is (sec,min,hr) of dial i. Only the hands whose angle
+        #changed are rewritten; returns the indices of the touched batches.
+        dirty = set()
+        for i in range(0,len(angles)):
+            new = angles[i]
+            old = self.angles[i]
+            if old == new:
+                continue
+            b,j = divmod(i,self.batch)
+            batch = self.batches[b]
+            dial = self.dials[i]
+            radii = (dial.sec_radius,dial.min_radius,dial.hr_radius)
+            for k in range(0,3):
+                if old is None or old[k] != new[k]:
+                    dial.hand_quad(batch.hand_vertices,(j*3 + k)*16,
+                                   radii[k],new[k],HAND_WIDTHS[k])
+            self.angles[i] = new
+            dirty.add(b)
+        return dirty
+
+if __name__ == '__main__':
+
+    n = 2000
+    t = timeit.timeit(lambda: Dial(800,600),number=n)
+    print("Dial build:  %8.2f us" % (t/n*1e6))
+    t = timeit.timeit(lambda: dial(800,600),number=n)
+    print("Cached dial: %8.2f us" % (t/n*1e6))
+    d = dial(800,600)
+    t = timeit.timeit(lambda: d.hand_points(d.sec_radius,1.0),number=n)
+    print("Hand points: %8.2f us" % (t/n*1e6))
@@ -0,0 +1,113 @@
+import os,sys,time,random,argparse,shutil,tempfile
+from loader import FileLoader
+from document import Document
+from saver import FileSaver
+
+#Measures saving a big edited document. First the save runs on the calling
+#thread, as it did in the UI before, so the whole save is one stall. Then
+#it runs on a FileSaver while this thread plays the UI: one keystroke and
+#one window of lines every frame at 60 frames a second. Prints throughput
+#and how late the frames were.
+#Usage: python bench_save.py [--megabytes 200] [--edits 1000] [--no-sync]
+#                            [--file PATH]
+
+FRAME = 1.0 / 60
+LINE = b"2024-05-01 12:00:00 INFO worker %06d handled request in 42 ms\n"
+
+def make_file(path, megabytes):
+
+    size = megabytes << 20
+    block = b"".join(LINE % i for i in range(10000))
+    with open(path,'wb') as f:
+        written = 0
+        while written < size:
+            f.write(block)
+            written += len(block)
+
+def load(path, edits):
+
+    loader = FileLoader(path)
+    loader.start()
+    loader.join()
+    document = Document(loader.data,loader.index)
+    for i in range(edits):
+        offset = random.randint(0,len(document))
+        document.replace(offset,min(8,len(document) - offset),b"edited")
+    return loader,document
+
+def percentile(values, p):
+
+    values = sorted(values)
+    return values[min(int(len(values) * p),len(values) - 1)]
+
+def blocking_save(document, target, sync):
+
+    saver = FileSaver(document.snapshot(),target,sync=sync)
+    start = time.perf_counter()
+    saver.run()
+    elapsed = time.perf_counter() - start
+    return saver,elapsed
+
+def background_save(document, target, sync):
+
+    saver = FileSaver(document.snapshot(),target,sync=sync)
+    frames = []
+    start = time.perf_counter()
+    saver.start()
+    last = start
+    while saver.is_alive():
+        #A keystroke at the end, and the lines on screen
+        document.replace(len(document),0,b"x")
+        line = document.line_count() - 40
+        document.lines(line,line + 40)
+        time.sleep(FRAME)
+        now = time.perf_counter()
+        frames.append(now - last)
+        last = now
+    elapsed = time.perf_counter() - start
+    return saver,elapsed,frames
+
+def main():
+
+    parser = argparse.ArgumentParser(description="Benchmark notepad saves")
+    parser.add_argument("--megabytes",type=int,default=200)
+    parser.add_argument("--edits",type=int,default=1000)
+    parser.add_argument("--no-sync",dest="sync",action="store_false")
+    parser.add_argument("--file",help="an existing file instead of a made up log")
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    try:
+        path = args.file
+        if path is None:
+            path = os.path.join(directory,"big.log")
+            make_file(path,args.megabytes)
+        target = os.path.join(directory,"saved.log")
+        loader,document = load(path,args.edits)
+        megabytes = len(document) / float(1 << 20)
+        print("%.0f MB, %d edits, %d pieces%s" %
+              (megabytes,args.edits,len(document.snapshot()),
+               ", fsync" if args.sync else ""))
+
+        saver,elapsed = blocking_save(document,target,args.sync)
+        if saver.error is not None:
+            sys.exit("save failed: %s" % saver.error)
+        print("    on the UI thread:  %.0f MB/s, UI stalled %.0f ms" %
+              (megabytes / elapsed,elapsed * 1e3))
+
+        saver,elapsed,frames = background_save(document,target,args.sync)
+        if saver.error is not None:
+            sys.exit("save failed: %s" % saver.error)
+        late = [max(frame - FRAME,0) for frame in frames]
+        print("    on a worker:       %.0f MB/s, %d frames, frame delay p50 %.1f ms,"
+              " p99 %.1f ms, max %.1f ms" %
+              (saver.size / float(1 << 20) / elapsed,len(frames),
+               percentile(late,0.5) * 1e3,percentile(late,0.99) * 1e3,
+               max(late) * 1e3))
+        loader.close()
+    finally:
+        shutil.rmtree(directory)
+
+if __name__ == '__main__':
+
+    main()
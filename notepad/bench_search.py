@@ -0,0 +1,68 @@
+import os,time,shutil,argparse,tempfile
+from bench_save import make_file, load, percentile, FRAME, LINE
+from search import DocumentSearch
+
+#Measures find and replace all over a big edited document on a worker,
+#while this thread plays the UI: one keystroke's worth of work and one
+#window of lines every frame at 60 frames a second. Prints how long each
+#took, how late the frames were and how long putting the replaced text in
+#took on this thread.
+#Usage: python bench_search.py [--lines 1000000] [--edits 1000]
+#                              [--find worker] [--replace task]
+
+def run(document, pattern, regex, replacement):
+
+    search = DocumentSearch(document,pattern,regex,replacement=replacement)
+    frames = []
+    start = time.perf_counter()
+    search.start()
+    last = start
+    while search.is_alive():
+        line = document.line_count() // 2
+        document.lines(line,line + 40)
+        time.sleep(FRAME)
+        now = time.perf_counter()
+        frames.append(now - last)
+        last = now
+    elapsed = time.perf_counter() - start
+    late = [max(frame - FRAME,0) for frame in frames] or [0]
+    print("    %-26s %8d matches in %.2f s, frame delay p50 %.1f ms,"
+          " p99 %.1f ms, max %.1f ms" %
+          ("%s -> %s" % (pattern,replacement) if replacement is not None
+           else pattern,search.count(),elapsed,percentile(late,0.5) * 1e3,
+           percentile(late,0.99) * 1e3,max(late) * 1e3))
+    return search
+
+def main():
+
+    parser = argparse.ArgumentParser(description="Benchmark notepad find and replace")
+    parser.add_argument("--lines",type=int,default=1000000)
+    parser.add_argument("--edits",type=int,default=1000)
+    parser.add_argument("--find",default="worker")
+    parser.add_argument("--replace",default="task")
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    try:
+        path = os.path.join(directory,"big.log")
+        make_file(path,len(LINE % 0) * args.lines >> 20)
+        loader,document = load(path,args.edits)
+        print("%d lines, %.0f MB, %d edits" %
+              (document.line_count(),len(document) / float(1 << 20),args.edits))
+        run(document,args.find,False,None)
+        run(document,r"in (\d+) ms",True,None)
+        search = run(document,args.find,False,args.replace)
+        start = time.perf_counter()
+        document.swap(search.tree,search.first_change())
+        print("    putting the replaced text in took %.3f ms" %
+              ((time.perf_counter() - start) * 1e3))
+        start = time.perf_counter()
+        document.undo()
+        print("    undoing it took %.3f ms" % ((time.perf_counter() - start) * 1e3))
+        loader.close()
+    finally:
+        shutil.rmtree(directory)
+
+if __name__ == '__main__':
+
+    main()
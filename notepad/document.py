@@ -0,0 +1,380 @@
+import random,bisect,threading
+from loader import LineIndex, ENCODING
+
+#A piece table. The text is a sequence of pieces, each a run of bytes in
+#one of two buffers: the file as loaded, never copied or changed, and an
+#append only buffer of everything typed since. The pieces are the nodes of
+#a treap ordered by position, each knowing the bytes and newlines in its
+#subtree, so finding an offset or a line, inserting and deleting all take
+#O(log n) however big the file is. Undo and redo records only hold pieces,
+#never text, or for a replace all the trees from before and after it.
+
+BASE = 0
+ADDED = 1
+
+class Piece(object):
+
+    __slots__ = ('buffer','start','length','newlines','priority',
+                 'left','right','size','lines')
+
+    def __init__(self, buffer, start, length, newlines):
+
+        self.buffer = buffer
+        self.start = start
+        self.length = length
+        self.newlines = newlines
+        self.priority = random.random()
+        self.left = None
+        self.right = None
+        self.size = length
+        self.lines = newlines
+
+def size(node):
+
+    return node.size if node is not None else 0
+
+def lines(node):
+
+    return node.lines if node is not None else 0
+
+def update(node):
+
+    node.size = node.length + size(node.left) + size(node.right)
+    node.lines = node.newlines + lines(node.left) + lines(node.right)
+
+def merge(a, b):
+
+    if a is None:
+        return b
+    if b is None:
+        return a
+    if a.priority > b.priority:
+        a.right = merge(a.right,b)
+        update(a)
+        return a
+    b.left = merge(a,b.left)
+    update(b)
+    return b
+
+class Document(object):
+
+    def __init__(self, base=b"", base_index=None):
+
+        if base_index is None:
+            base_index = LineIndex()
+            base_index.add_chunk(base,0)
+        self.buffers = [base,bytearray()]
+        self.indexes = [base_index,LineIndex()]
+        #Buffers are only ever appended, and under this lock, so a search
+        #on another thread can add one while the text is edited
+        self.lock = threading.Lock()
+        self.root = None
+        if len(base):
+            self.root = self.piece(BASE,0,len(base))
+        self.undo_stack = []
+        self.redo_stack = []
+        self.modified = False
+        #Counts changes, so work done on an older state can tell
+        self.version = 0
+        #(offset, newlines removed, newlines added) of the last change, None
+        #for a swap
+        self.last_change = None
+
+    def piece(self, buffer, start, length):
+
+        return Piece(buffer,start,length,
+                     self.count_newlines(buffer,start,start + length))
+
+    def count_newlines(self, buffer, start, end):
+
+        #Line starts are one past each newline
+        starts = self.indexes[buffer].starts
+        return bisect.bisect_right(starts,end) - bisect.bisect_right(starts,start)
+
+    def __len__(self):
+
+        return size(self.root)
+
+    def line_count(self):
+
+        return lines(self.root) + 1
+
+    def split(self, node, offset):
+
+        #(pieces before offset, pieces from offset on), cutting the piece
+        #offset falls in two
+        if node is None:
+            return None,None
+        left = size(node.left)
+        if offset <= left:
+            a,b = self.split(node.left,offset)
+            node.left = b
+            update(node)
+            return a,node
+        if offset >= left + node.length:
+            a,b = self.split(node.right,offset - left - node.length)
+            node.right = a
+            update(node)
+            return node,b
+        cut = offset - left
+        rest = self.piece(node.buffer,node.start + cut,node.length - cut)
+        node.length = cut
+        node.newlines -= rest.newlines
+        right = node.right
+        node.right = None
+        update(node)
+        return node,merge(rest,right)
+
+    def pieces(self, node, out):
+
+        #In order (buffer, start, length) of every piece under node
+        stack = []
+        while stack or node is not None:
+            if node is not None:
+                stack.append(node)
+                node = node.left
+                continue
+            node = stack.pop()
+            out.append((node.buffer,node.start,node.length))
+            node = node.right
+        return out
+
+    def build(self, pieces):
+
+        tree = None
+        for buffer,start,length in pieces:
+            tree = merge(tree,self.piece(buffer,start,length))
+        return tree
+
+    def balanced(self, pieces, lo=0, hi=None, depth=0):
+
+        #A tree of pieces[lo:hi] built in O(n) rather than a merge at a
+        #time, with priorities that fall with depth so that it is a treap
+        if hi is None:
+            hi = len(pieces)
+        if lo >= hi:
+            return None
+        mid = (lo + hi) // 2
+        node = self.piece(*pieces[mid])
+        node.priority = 1.0 - depth / 64.0
+        node.left = self.balanced(pieces,lo,mid,depth + 1)
+        node.right = self.balanced(pieces,mid + 1,hi,depth + 1)
+        update(node)
+        return node
+
+    def add_buffer(self):
+
+        #A new buffer for pieces built elsewhere, returning its number
+        with self.lock:
+            self.buffers.append(bytearray())
+            self.indexes.append(LineIndex())
+            return len(self.buffers) - 1
+
+    def extend_last(self, tree, buffer, start, length):
+
+        #Grows the last piece of tree if it ends where the new bytes start,
+        #as when typing. Returns False if it does not.
+        node = tree
+        while node is not None and node.right is not None:
+            node = node.right
+        if (node is None or node.buffer != buffer or
+                node.start + node.length != start):
+            return False
+        newlines = self.count_newlines(buffer,start,start + length)
+        node = tree
+        while node is not None:
+            node.size += length
+            node.lines += newlines
+            if node.right is None:
+                node.length += length
+                node.newlines += newlines
+            node = node.right
+        return True
+
+    def splice(self, offset, length, pieces):
+
+        #Replaces length bytes at offset with pieces and returns the pieces
+        #that were there
+        left,rest = self.split(self.root,offset)
+        removed,right = self.split(rest,length)
+        old = self.pieces(removed,[])
+        added = sum(self.count_newlines(buffer,start,start + length)
+                    for buffer,start,length in pieces)
+        if len(pieces) == 1 and self.extend_last(left,*pieces[0]):
+            middle = None
+        else:
+            middle = self.build(pieces)
+        self.root = merge(merge(left,middle),right)
+        self.changed()
+        self.last_change = (offset,lines(removed),added)
+        return old
+
+    def changed(self):
+
+        self.modified = True
+        self.version += 1
+
+    def swap(self, root, offset):
+
+        #Puts in root, a whole tree built from this document's buffers, as
+        #one undo step. offset is where its first change is.
+        self.undo_stack.append((offset,self.root,root))
+        self.redo_stack = []
+        self.root = root
+        self.changed()
+        self.last_change = None
+
+    def replace(self, offset, length, data):
+
+        #The one edit operation: delete length bytes at offset, insert data
+        if not length and not data:
+            return
+        added = self.buffers[ADDED]
+        pieces = []
+        if data:
+            pieces.append((ADDED,len(added),len(data)))
+            self.indexes[ADDED].add_chunk(data,len(added))
+            added.extend(data)
+        removed = self.splice(offset,length,pieces)
+        self.redo_stack = []
+        last = self.undo_stack[-1] if self.undo_stack else None
+        #Typing a line goes in one undo step
+        if (last is not None and not removed and not last[1] and
+                len(pieces) == 1 and b"\n" not in data and
+                offset == last[0] + sum(p[2] for p in last[2])):
+            buffer,start,count = last[2][-1]
+            if buffer == ADDED and start + count == pieces[0][1]:
+                last[2][-1] = (buffer,start,count + len(data))
+            else:
+                last[2].append(pieces[0])
+            return
+        self.undo_stack.append((offset,removed,pieces))
+
+    def undo(self):
+
+        #Returns the offset of the change, or None
+        if not self.undo_stack:
+            return None
+        offset,removed,inserted = self.undo_stack.pop()
+        if isinstance(removed,list):
+            self.splice(offset,sum(p[2] for p in inserted),removed)
+        else:
+            #A swap, undone by swapping back. The tree now in place has the
+            #text of inserted, if not its shape after later edits and undos.
+            inserted = self.root
+            self.root = removed
+            self.changed()
+            self.last_change = None
+        self.redo_stack.append((offset,removed,inserted))
+        return offset
+
+    def redo(self):
+
+        if not self.redo_stack:
+            return None
+        offset,removed,inserted = self.redo_stack.pop()
+        if isinstance(removed,list):
+            self.splice(offset,sum(p[2] for p in removed),inserted)
+        else:
+            removed = self.root
+            self.root = inserted
+            self.changed()
+            self.last_change = None
+        self.undo_stack.append((offset,removed,inserted))
+        return offset
+
+    def snapshot(self):
+
+        #(buffer, start, length) of every piece, which stay valid however
+        #the document is edited later as the buffers are only appended to
+        buffers = self.buffers
+        return [(buffers[buffer],start,length)
+                for buffer,start,length in self.pieces(self.root,[])]
+
+    def text(self, start, end):
+
+        #Bytes from start to end, walking only the pieces in the range
+        out = []
+        node = self.root
+        base = 0
+        stack = []
+        #Descend to the first piece that reaches past start
+        while node is not None:
+            left = size(node.left)
+            if start < base + left:
+                stack.append((node,base))
+                node = node.left
+            elif start < base + left + node.length:
+                stack.append((node,base))
+                break
+            else:
+                base += left + node.length
+                node = node.right
+        buffers = self.buffers
+        while stack:
+            node,base = stack.pop()
+            pos = base + size(node.left)
+            if pos >= end:
+                break
+            lo = max(start - pos,0)
+            hi = min(end - pos,node.length)
+            if lo < hi:
+                out.append(buffers[node.buffer][node.start + lo:node.start + hi])
+            #Then everything in the right subtree, leftmost first
+            child = node.right
+            child_base = pos + node.length
+            while child is not None:
+                stack.append((child,child_base))
+                child = child.left
+        return b"".join(bytes(part) for part in out)
+
+    def line_start(self, n):
+
+        #Byte offset of the start of line n
+        if n <= 0:
+            return 0
+        if n > lines(self.root):
+            return len(self)
+        node = self.root
+        offset = 0
+        while True:
+            left = lines(node.left)
+            if n <= left:
+                node = node.left
+            elif n <= left + node.newlines:
+                starts = self.indexes[node.buffer].starts
+                k = bisect.bisect_right(starts,node.start) + n - left - 1
+                return offset + size(node.left) + starts[k] - node.start
+            else:
+                n -= left + node.newlines
+                offset += size(node.left) + node.length
+                node = node.right
+
+    def line_of(self, offset):
+
+        #Number of the line offset is on
+        node = self.root
+        line = 0
+        while node is not None:
+            left = size(node.left)
+            if offset < left:
+                node = node.left
+            elif offset < left + node.length:
+                return (line + lines(node.left) +
+                        self.count_newlines(node.buffer,node.start,
+                                            node.start + offset - left))
+            else:
+                line += lines(node.left) + node.newlines
+                offset -= left + node.length
+                node = node.right
+        return line
+
+    def lines(self, first, last):
+
+        #Text of lines first to last - 1
+        start = self.line_start(first)
+        if last >= self.line_count():
+            end = len(self)
+        else:
+            end = self.line_start(last) - 1
+        return self.text(start,max(start,end)).decode(ENCODING,'replace')
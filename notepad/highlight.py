@@ -0,0 +1,268 @@
+import re,time,bisect,itertools
+
+#Syntax highlighting for configs and scripts. The lexer takes one line and
+#the state it starts in, which is ROOT or the opener of a string or
+#comment still open from an earlier line, and gives back the tokens and the
+#state the next line starts in. Highlighter caches that state for every
+#line, so after an edit only the lines from the edited one to where the
+#state comes out as before are lexed again.
+
+ROOT = ""
+#What closes each multi-line state, and how it is coloured
+CLOSE = {'"""': '"""', "'''": "'''", '/*': '*/'}
+KIND = {'"""': 'string', "'''": 'string', '/*': 'comment'}
+
+#Multi-line strings and comments, opened only in the files that have them,
+#as /* in a shell script is a glob
+OPENERS = {'.py': ('"""',"'''"),
+           '.toml': ('"""',"'''"),
+           '.js': ('/*',),
+           '.c': ('/*',),
+           '.h': ('/*',)}
+
+RULES = r"""
+    (?P<comment>\#.*|//.*|^\s*;.*)
+  | (?P<string>"(?:[^"\\]|\\.)*"?|'(?:[^'\\]|\\.)*'?)
+  | (?P<section>^\s*\[[^\]]*\])
+  | (?P<keyword>\b(?:if|elif|else|for|while|in|not|and|or|is|def|class|
+        return|import|from|with|as|try|except|finally|raise|function|var|
+        let|const|then|fi|do|done|case|esac|export|local|true|false|True|
+        False|None|null|yes|no|on|off)\b)
+  | (?P<key>^\s*[\w.\-]+(?=\s*[=:]))
+  | (?P<number>\b(?:0[xX][0-9a-fA-F]+|\d+(?:\.\d+)?(?:[eE][+-]?\d+)?)\b)
+  | (?P<variable>\$\{?\w+\}?)
+"""
+
+def token_regex(openers=()):
+
+    #The lexer's regex, with the given multi-line openers
+    if not openers:
+        return re.compile(RULES,re.X)
+    opener = "|".join(re.escape(o) for o in openers)
+    return re.compile("(?P<open>%s) |" % opener + RULES,re.X)
+
+TOKEN = token_regex()
+
+COLORS = {'comment': '7f8c8d',
+          'string': '98c379',
+          'section': 'e5c07b',
+          'keyword': 'c678dd',
+          'key': '61afef',
+          'number': 'd19a66',
+          'variable': 'e06c75'}
+
+#Lines whose state is kept in one list, see LineStates
+BLOCK_LINES = 4096
+#Lines fetched from the document at a time
+BATCH_LINES = 256
+#Lines whose markup is remembered
+CACHE_LINES = 4096
+
+def lex(line, state=ROOT, token=TOKEN):
+
+    #Returns ([(start, end, kind)], state at the end of line)
+    tokens = []
+    pos = 0
+    start = 0
+    while True:
+        if state != ROOT:
+            close = CLOSE[state]
+            end = line.find(close,pos)
+            if end == -1:
+                tokens.append((start,len(line),KIND[state]))
+                return tokens,state
+            pos = end + len(close)
+            tokens.append((start,pos,KIND[state]))
+            state = ROOT
+        m = token.search(line,pos)
+        if m is None:
+            return tokens,state
+        if m.lastgroup == 'open':
+            state = m.group()
+            start = m.start()
+        else:
+            tokens.append((m.start(),m.end(),m.lastgroup))
+        pos = m.end()
+
+def escape(text, tab_width):
+
+    return (text.replace("&","&amp;").replace("[","&bl;").replace("]","&br;")
+            .replace("\t"," " * tab_width))
+
+def markup(line, tokens, tab_width=4):
+
+    #line in Kivy markup, each token in its colour
+    out = []
+    pos = 0
+    for start,end,kind in tokens:
+        out.append(escape(line[pos:start],tab_width))
+        out.append("[color=%s]%s[/color]" %
+                   (COLORS[kind],escape(line[start:end],tab_width)))
+        pos = end
+    out.append(escape(line[pos:],tab_width))
+    return "".join(out)
+
+class LineStates(object):
+
+    #The state at the start of each line, None where not lexed yet. Kept
+    #in blocks of up to 2 * BLOCK_LINES so that adding or removing lines
+    #moves one block along rather than every state after them.
+    def __init__(self, count):
+
+        self.blocks = [[None] * min(BLOCK_LINES,count - i)
+                       for i in range(0,count,BLOCK_LINES)] or [[]]
+        self.update()
+
+    def update(self):
+
+        lengths = [len(block) for block in self.blocks]
+        self.starts = list(itertools.accumulate([0] + lengths[:-1]))
+
+    def locate(self, n):
+
+        i = bisect.bisect_right(self.starts,n) - 1
+        return self.blocks[i],n - self.starts[i]
+
+    def __getitem__(self, n):
+
+        block,k = self.locate(n)
+        return block[k]
+
+    def __setitem__(self, n, state):
+
+        block,k = self.locate(n)
+        block[k] = state
+
+    def splice(self, n, removed, added):
+
+        #Replaces the states of lines n to n + removed - 1 with added Nones
+        i = bisect.bisect_right(self.starts,n) - 1
+        j = bisect.bisect_right(self.starts,n + removed) - 1
+        merged = list(itertools.chain.from_iterable(self.blocks[i:j + 1]))
+        k = n - self.starts[i]
+        merged[k:k + removed] = [None] * added
+        if len(merged) > 2 * BLOCK_LINES:
+            new = [merged[p:p + BLOCK_LINES]
+                   for p in range(0,len(merged),BLOCK_LINES)]
+        elif merged or len(self.blocks) == j - i + 1:
+            new = [merged]
+        else:
+            new = []
+        self.blocks[i:j + 1] = new
+        self.update()
+
+class Highlighter(object):
+
+    #Keeps the lexer state of every line of a Document. The lines on
+    #screen are lexed first, from the cached state of the first one, and
+    #the rest in slices of a time budget by run(). dirty holds the lines
+    #whose state is right but after which the cache has not been checked,
+    #where lexing stopped short or has not begun. openers are the file's
+    #own from OPENERS.
+    def __init__(self, document, tab_width=4, openers=()):
+
+        self.document = document
+        self.tab_width = tab_width
+        self.openers = openers
+        self.token = token_regex(openers)
+        self.reset()
+
+    def reset(self):
+
+        self.states = LineStates(self.document.line_count())
+        self.states[0] = ROOT
+        self.dirty = [0]
+        self.version = self.document.version
+        #Lowest line whose state changed since the last call of changes()
+        self.changed = None
+        self.cache = {}
+
+    def line_state(self, n):
+
+        state = self.states[n]
+        return ROOT if state is None else state
+
+    def relex(self, n, stop, deadline=None):
+
+        #Lexes from line n until the state a line starts in comes out as
+        #cached, the last line, line stop or the deadline. Returns the line
+        #it got to and whether the cache from there on can be trusted.
+        states = self.states
+        last = self.document.line_count() - 1
+        state = self.line_state(n)
+        while n < last:
+            if n >= stop or (deadline is not None and
+                             time.perf_counter() > deadline):
+                return n,False
+            batch = min(n + BATCH_LINES,last,stop)
+            for text in self.document.lines(n,batch).split("\n"):
+                tokens,state = lex(text,state,self.token)
+                n += 1
+                if states[n] == state:
+                    return n,True
+                states[n] = state
+                if self.changed is None or n < self.changed:
+                    self.changed = n
+        #Past the last line, so that a dirty one there is settled too
+        return last + 1,True
+
+    def settle(self, start, end, finished):
+
+        #Dirty lines lexed past are done with. One lexing stopped at is
+        #still unchecked after, even if its own state came out as cached.
+        self.dirty = [p for p in self.dirty if not start <= p < end]
+        if not finished:
+            bisect.insort(self.dirty,end)
+
+    def edit(self, line, removed, added, stop):
+
+        #Lines line + 1 to line + removed were replaced by added new ones,
+        #and line itself may have changed. Lexes again up to line stop.
+        if self.document.version != self.version + 1:
+            #A change went by unseen
+            self.reset()
+            return
+        self.version = self.document.version
+        self.states.splice(line + 1,removed,added)
+        delta = added - removed
+        self.dirty = sorted(set(p if p <= line else max(p + delta,line)
+                                for p in self.dirty))
+        end,finished = self.relex(line,stop)
+        self.settle(line,end,finished)
+
+    def run(self, budget):
+
+        #Lexes from the first dirty line for up to budget seconds. Returns
+        #True while there is more to do.
+        deadline = time.perf_counter() + budget
+        while self.dirty and time.perf_counter() < deadline:
+            start = self.dirty[0]
+            end,finished = self.relex(start,self.document.line_count(),
+                                      deadline)
+            self.settle(start,end,finished)
+        return bool(self.dirty)
+
+    def changes(self):
+
+        #Lowest line whose state changed since the last call, or None
+        changed = self.changed
+        self.changed = None
+        return changed
+
+    def markup(self, first, lines):
+
+        #Kivy markup for lines, the text of the lines from first on
+        out = []
+        state = self.line_state(first)
+        cache = self.cache
+        if len(cache) > CACHE_LINES:
+            cache.clear()
+        for text in lines:
+            key = (state,text)
+            found = cache.get(key)
+            if found is None:
+                tokens,end = lex(text,state,self.token)
+                found = cache[key] = (markup(text,tokens,self.tab_width),end)
+            out.append(found[0])
+            state = found[1]
+        return out
@@ -0,0 +1,142 @@
+import os,mmap,threading,itertools
+from array import array
+
+#Files up to MMAP_BYTES are read into memory CHUNK bytes at a time. Bigger
+#ones are mapped, so the file itself is the buffer and only the lines on
+#screen are ever decoded. Either way the start of every line is indexed on
+#the loader's thread, one chunk at a time, and notify is called after each.
+
+MMAP_BYTES = 8 << 20
+CHUNK = 1 << 20
+ENCODING = 'utf-8'
+
+class LineIndex(object):
+
+    #Byte offset where each line starts. Line n runs from starts[n] to the
+    #newline just before starts[n + 1].
+    def __init__(self):
+
+        self.starts = array('L',[0])
+        self.lock = threading.Lock()
+
+    def add_chunk(self, chunk, offset):
+
+        #Indexes the newlines of chunk, which starts at byte offset. The
+        #arithmetic runs in C through map and accumulate.
+        parts = chunk.split(b"\n")
+        lengths = itertools.islice(map(len,parts),len(parts) - 1)
+        ends = itertools.accumulate(map((1).__add__,lengths))
+        with self.lock:
+            self.starts.extend(map(offset.__add__,ends))
+
+    def __len__(self):
+
+        return len(self.starts)
+
+    def span(self, first, last, size):
+
+        #Byte range of lines first to last - 1, without the final newline
+        with self.lock:
+            start = self.starts[first]
+            if last < len(self.starts):
+                return start,self.starts[last] - 1
+        return start,size
+
+class FileLoader(threading.Thread):
+
+    def __init__(self, path, notify=None):
+
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.path = path
+        self.size = os.path.getsize(path)
+        self.mapped = self.size > MMAP_BYTES
+        self.index = LineIndex()
+        #bytes, or the mmap, once known
+        self.data = None
+        #The chunks read so far, to show lines from while the rest loads.
+        #All but the last are CHUNK bytes long.
+        self.chunks = []
+        self.loaded = 0
+        self.notify = notify
+        self.cancelled = False
+        self.done = False
+        self.error = None
+
+    def run(self):
+
+        try:
+            with open(self.path,'rb') as f:
+                if self.mapped:
+                    self.data = mmap.mmap(f.fileno(),0,access=mmap.ACCESS_READ)
+                    self.index_mapped()
+                else:
+                    self.read(f)
+        except (IOError,OSError,ValueError) as e:
+            self.error = e
+        self.done = True
+        self.publish()
+
+    def read(self, f):
+
+        #Each chunk is kept before its lines are indexed, so that every
+        #line lines() can see is there to be read
+        while not self.cancelled:
+            chunk = f.read(CHUNK)
+            if not chunk:
+                break
+            self.chunks.append(chunk)
+            self.index.add_chunk(chunk,self.loaded)
+            self.loaded += len(chunk)
+            self.publish()
+        if not self.cancelled:
+            self.data = b"".join(self.chunks)
+        self.chunks = []
+
+    def index_mapped(self):
+
+        pos = 0
+        while pos < self.size and not self.cancelled:
+            chunk = self.data[pos:pos + CHUNK]
+            self.index.add_chunk(chunk,pos)
+            pos += len(chunk)
+            self.loaded = pos
+            self.publish()
+
+    def publish(self):
+
+        if self.notify is not None:
+            self.notify()
+
+    def cancel(self):
+
+        self.cancelled = True
+
+    def progress(self):
+
+        return float(self.loaded) / max(self.size,1)
+
+    def lines(self, first, last):
+
+        #Text of lines first to last - 1 of those indexed so far
+        last = min(last,len(self.index))
+        if first >= last:
+            return u""
+        start,end = self.index.span(first,last,self.loaded)
+        #chunks before data: the list is only let go of once data is set
+        chunks = self.chunks
+        data = self.data
+        if data is None:
+            #Still reading, so from the chunks the lines are in
+            i = start // CHUNK
+            data = b"".join(chunks[i:end // CHUNK + 1])
+            start -= i * CHUNK
+            end -= i * CHUNK
+        return data[start:end].decode(ENCODING,'replace')
+
+    def close(self):
+
+        self.cancel()
+        if self.mapped and self.data is not None:
+            self.join()
+            self.data.close()
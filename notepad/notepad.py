@@ -9,7 +9,24 @@ from kivy.core.text import *
 from kivy.core.text.markup import *
 from kivy.properties import *
 from kivy.uix.popup import Popup
-import os
+from kivy.clock import Clock
+from kivy.graphics import (Color, Rectangle, InstructionGroup, ScissorPush,
+                           ScissorPop)
+from kivy.core.text import Label as CoreLabel
+from loader import FileLoader, ENCODING
+from document import Document
+from saver import FileSaver
+from search import DocumentSearch
+from highlight import Highlighter,OPENERS
+import os,re
+
+#Files highlighted as configs and scripts
+HIGHLIGHT_EXTENSIONS = ('.py','.sh','.cfg','.conf','.ini','.toml','.yaml',
+                        '.yml','.json','.js','.c','.h','.kv','.properties')
+#Seconds of each frame spent lexing the lines off screen
+HIGHLIGHT_BUDGET = 0.004
+#Line textures kept for the coloured text
+TEXTURE_CACHE = 512
 
 class notepadApp(App):
 
@@ -29,6 +46,123 @@ class SaveDialog(FloatLayout):
     save_file = ObjectProperty(None)
     cancel  = ObjectProperty(None)
 
+def common_prefix(a, b):
+
+    n = min(len(a),len(b))
+    i = 0
+    while i < n and a[i] == b[i]:
+        i += 1
+    return i
+
+def common_suffix(a, b, limit):
+
+    i = 0
+    while i < limit and a[-1 - i] == b[-1 - i]:
+        i += 1
+    return i
+
+class NoteTextInput(TextInput):
+
+    #Only the lines on screen are in the text. The wheel, the page keys and
+    #the arrows at the edges move that window over the document, and undo
+    #and redo are the document's. Lines are not wrapped, so that each is one
+    #row, as the window and the coloured lines drawn over it take them.
+    def __init__(self, **kwargs):
+
+        super(NoteTextInput, self).__init__(**kwargs)
+        self.text_color = list(self.foreground_color)
+        self.markups = None
+        self.textures = {}
+        self.markup_group = InstructionGroup()
+        self.canvas.after.add(self.markup_group)
+        self.bind(scroll_x = self.draw_markup,scroll_y = self.draw_markup,
+                  pos = self.draw_markup,size = self.draw_markup)
+
+    def show_markup(self, markups):
+
+        #Draws the lines in colour from markup over the text, which is not
+        #drawn itself meanwhile. None goes back to plain text.
+        self.markups = markups
+        if markups is None:
+            self.foreground_color = self.text_color
+        else:
+            self.foreground_color = (0,0,0,0)
+        self.draw_markup()
+
+    def draw_markup(self, *args):
+
+        group = self.markup_group
+        group.clear()
+        if self.markups is None:
+            return
+        #Placed as TextInput places its own lines
+        dy = self.line_height + self.line_spacing
+        left = self.x + self.padding[0] - self.scroll_x
+        top = self.top - self.padding[1] + self.scroll_y
+        group.add(ScissorPush(x=int(self.x),y=int(self.y),
+                              width=int(self.width),height=int(self.height)))
+        group.add(Color(1,1,1,1))
+        for row,text in enumerate(self.markups):
+            y = top - row*dy
+            if y < self.y:
+                break
+            if text == "" or y - dy > self.top:
+                continue
+            texture = self.line_texture(text)
+            group.add(Rectangle(texture=texture,size=texture.size,
+                                pos=(left,y - texture.height)))
+        group.add(ScissorPop())
+
+    def line_texture(self, text):
+
+        texture = self.textures.get(text)
+        if texture is None:
+            if len(self.textures) > TEXTURE_CACHE:
+                self.textures.clear()
+            label = MarkupLabel(text=text,font_name=self.font_name,
+                                font_size=self.font_size,color=self.text_color)
+            label.refresh()
+            texture = self.textures[text] = label.texture
+        return texture
+
+    def visible_rows(self):
+
+        line = self.line_height + self.line_spacing
+        return max(int((self.height - self.padding[1] - self.padding[3])/line),1)
+
+    def on_touch_down(self, touch):
+
+        if touch.is_mouse_scrolling and self.collide_point(*touch.pos):
+            if touch.button == 'scrolldown':
+                self.win_parent.scroll_by(3)
+            elif touch.button == 'scrollup':
+                self.win_parent.scroll_by(-3)
+            return True
+        return super(NoteTextInput, self).on_touch_down(touch)
+
+    def keyboard_on_key_down(self, window, keycode, text, modifiers):
+
+        key = keycode[1]
+        parent = self.win_parent
+        if key in ('pageup','pagedown'):
+            rows = self.visible_rows()
+            parent.scroll_by(-rows if key == 'pageup' else rows)
+            return True
+        if 'ctrl' in modifiers and key in ('z','y'):
+            parent.undo(key == 'y' or 'shift' in modifiers)
+            return True
+        if key == 'f3':
+            parent.goto_match(-1 if 'shift' in modifiers else 1)
+            return True
+        col,row = self.cursor
+        if ((key == 'up' and row == 0) or
+                (key == 'down' and row == self.text.count("\n"))):
+            if parent.scroll_by(-1 if key == 'up' else 1):
+                self.cursor = (col,min(row,self.text.count("\n")))
+                return True
+        return super(NoteTextInput, self).keyboard_on_key_down(
+            window,keycode,text,modifiers)
+
 class MainWindow(BoxLayout):
 
     open_button = ObjectProperty()
@@ -39,12 +173,33 @@ class MainWindow(BoxLayout):
     paste_button = ObjectProperty()
     delete_button = ObjectProperty()
     text_view = ObjectProperty()
+    status_label = ObjectProperty()
+    find_input = ObjectProperty()
+    replace_input = ObjectProperty()
+    regex_button = ObjectProperty()
     
     def __init__(self, **kwargs):
 
         super(MainWindow, self).__init__()
         self.clipboard_text = ""
         self.filepath = ""
+        self.loader = None
+        self.document = Document()
+        self.first_line = 0
+        #The text on screen as last shown, which edits are diffed against
+        self.window_text = u""
+        self.rendering = False
+        self.load_trigger = Clock.create_trigger(self.load_progress)
+        self.saver = None
+        self.save_trigger = Clock.create_trigger(self.save_progress)
+        self.search = None
+        self.search_index = -1
+        self.search_trigger = Clock.create_trigger(self.search_progress)
+        self.highlighter = None
+        self.highlight_trigger = Clock.create_trigger(self.highlight_step)
+        self.text_view.win_parent = self
+        self.text_view.bind(size = self.show_window)
+        self.text_view.bind(text = self.text_changed)
         
     def on_open(self, *args):
 
@@ -56,13 +211,300 @@ class MainWindow(BoxLayout):
 
     def open_file(self,path,filename):
         
-        self.filepath = filename[0]
-        f = open(self.filepath,'r')
-        s = f.read()
-        self.text_view.text = s
-        f.close()
+        #Loads on a worker thread; load_progress shows the first screen as
+        #soon as it is read and the rest as it comes
+        if not filename:
+            return
         self.cancel_dialog()
+        self.stop_search()
+        self.close_loader()
+        self.filepath = filename[0]
+        try:
+            self.loader = FileLoader(self.filepath,self.load_trigger)
+        except OSError:
+            self.filepath = ""
+            return
+        self.document = None
+        self.update_highlighter()
+        self.first_line = 0
+        self.text_view.readonly = True
+        self.show_window()
+        self.loader.start()
+
+    def load_progress(self, dt):
+
+        loader = self.loader
+        if loader is None:
+            return
+        if loader.error is not None:
+            self.status_label.text = "Cannot open: %s" % loader.error
+            self.new_document()
+            return
+        if loader.done and self.document is None:
+            #The loaded bytes, or the mapping, are the document's base as
+            #they are
+            self.document = Document(loader.data,loader.index)
+            self.text_view.readonly = False
+            self.update_highlighter()
+        self.show_window()
+        if loader.done:
+            self.status_label.text = os.path.basename(self.filepath)
+        else:
+            self.status_label.text = "Loading %d%%" % (100*loader.progress())
+
+    def stop_loading(self, *args):
+
+        #Cancelling leaves an empty new document rather than part of the
+        #file, which saving would otherwise truncate
+        if self.loader is not None and not self.loader.done:
+            self.new_document()
+            self.status_label.text = "Cancelled"
+
+    def new_document(self):
+
+        self.document = Document()
+        self.stop_search()
+        self.close_loader()
+        self.filepath = ""
+        self.first_line = 0
+        self.text_view.readonly = False
+        self.update_highlighter()
+        self.show_window()
+
+    def close_loader(self):
+
+        if self.loader is not None:
+            self.loader.notify = None
+            if self.loader.mapped and self.saver is not None:
+                #A save may still be reading from the mapping
+                self.saver.join()
+            self.loader.close()
+        self.loader = None
+
+    def source(self):
+
+        #What the window shows: the loader until the document is ready
+        if self.document is None:
+            return self.loader
+        return self.document
+
+    def line_count(self):
+
+        if self.document is None:
+            return len(self.loader.index)
+        return self.document.line_count()
+
+    def show_window(self, *args):
+
+        #Decodes just the lines on screen
+        source = self.source()
+        rows = self.text_view.visible_rows()
+        self.rendering = True
+        self.text_view.text = source.lines(self.first_line,
+                                           self.first_line + rows)
+        self.rendering = False
+        self.window_text = self.text_view.text
+        self.show_highlight()
+
+    def scroll_by(self, lines):
+
+        #Returns how many lines the window moved
+        rows = self.text_view.visible_rows()
+        last = max(self.line_count() - rows,0)
+        first = max(min(self.first_line + lines,last),0)
+        moved = first - self.first_line
+        if moved:
+            self.first_line = first
+            self.show_window()
+        return moved
+
+    def text_changed(self, instance, text):
+
+        #Mirrors an edit in the window into the document as one replace,
+        #found by diffing against the text last shown
+        if self.rendering or self.document is None:
+            return
+        old = self.window_text
+        prefix = common_prefix(old,text)
+        suffix = common_suffix(old,text,min(len(old),len(text)) - prefix)
+        offset = (self.document.line_start(self.first_line) +
+                  len(old[:prefix].encode(ENCODING)))
+        deleted = len(old[prefix:len(old) - suffix].encode(ENCODING))
+        inserted = text[prefix:len(text) - suffix].encode(ENCODING)
+        self.document.replace(offset,deleted,inserted)
+        self.window_text = text
+        self.highlight_change()
+        self.show_highlight()
+
+    def undo(self, redo=False):
+
+        if self.document is None:
+            return
+        if redo:
+            offset = self.document.redo()
+        else:
+            offset = self.document.undo()
+        if offset is not None:
+            self.highlight_change()
+            self.show_offset(offset)
+
+    def show_offset(self, offset):
+
+        #Moves the window to offset if it is off screen and puts the cursor
+        #there
+        document = self.document
+        line = document.line_of(offset)
+        rows = self.text_view.visible_rows()
+        if not self.first_line <= line < self.first_line + rows:
+            self.first_line = max(line - rows // 2,0)
+        self.show_window()
+        start = document.line_start(line)
+        col = len(document.text(start,offset).decode(ENCODING,'replace'))
+        self.text_view.cursor = (col,line - self.first_line)
         
+    def update_highlighter(self):
+
+        #Configs and scripts are highlighted, by their extension
+        extension = os.path.splitext(self.filepath)[1].lower()
+        openers = OPENERS.get(extension,())
+        if self.document is None or extension not in HIGHLIGHT_EXTENSIONS:
+            self.highlighter = None
+        elif (self.highlighter is None or
+              self.highlighter.document is not self.document or
+              self.highlighter.openers != openers):
+            self.highlighter = Highlighter(self.document,
+                                           self.text_view.tab_width,openers)
+            self.highlight_trigger()
+
+    def highlight_change(self):
+
+        #Passes the last change on to the highlighter, which lexes the
+        #lines to the bottom of the screen now and the rest frame by frame
+        highlighter = self.highlighter
+        if highlighter is None or highlighter.version == self.document.version:
+            return
+        change = self.document.last_change
+        if change is None:
+            highlighter.reset()
+        else:
+            offset,removed,added = change
+            bottom = self.first_line + self.window_text.count("\n") + 1
+            highlighter.edit(self.document.line_of(offset),removed,added,bottom)
+        self.highlight_trigger()
+
+    def highlight_step(self, dt):
+
+        highlighter = self.highlighter
+        if highlighter is None:
+            return
+        more = highlighter.run(HIGHLIGHT_BUDGET)
+        changed = highlighter.changes()
+        bottom = self.first_line + self.text_view.visible_rows()
+        if changed is not None and changed <= bottom:
+            self.show_highlight()
+        if more:
+            self.highlight_trigger()
+
+    def show_highlight(self):
+
+        highlighter = self.highlighter
+        if highlighter is None:
+            self.text_view.show_markup(None)
+            return
+        lines = self.window_text.split("\n")
+        self.text_view.show_markup(highlighter.markup(self.first_line,lines))
+
+    def start_search(self, replace=False):
+
+        #Finds the text in the find box, as a regex if Regex is down, and
+        #with replace replaces every match with the text in the replace box
+        self.stop_search()
+        pattern = self.find_input.text
+        if pattern == "" or self.document is None:
+            return
+        replacement = self.replace_input.text if replace else None
+        try:
+            self.search = DocumentSearch(self.document,pattern,
+                                         self.regex_button.state == 'down',
+                                         replacement=replacement,
+                                         notify=self.search_trigger)
+        except re.error as e:
+            self.status_label.text = "Bad pattern: %s" % e
+            self.search = None
+            return
+        self.search.start()
+
+    def stop_search(self):
+
+        if self.search is not None:
+            self.search.cancel()
+        self.search = None
+        self.search_index = -1
+
+    def search_progress(self, dt):
+
+        search = self.search
+        if search is None:
+            return
+        if search.error is not None:
+            self.status_label.text = "Bad replacement: %s" % search.error
+            self.stop_search()
+            return
+        if search.replacement is None:
+            #Jumps to the first match as soon as the worker finds it
+            if self.search_index == -1:
+                self.goto_match(1)
+            self.status_label.text = "%d matches%s" % (
+                search.count(),"" if search.done else "...")
+            return
+        if not search.done:
+            self.status_label.text = "Replacing, %d matches" % search.count()
+            return
+        self.search = None
+        if search.tree is None:
+            self.status_label.text = "No matches"
+        elif (search.document is not self.document or
+              search.version != self.document.version):
+            self.status_label.text = "Changed while replacing, nothing replaced"
+        else:
+            #The tree was built on the worker, putting it in is one step,
+            #and one undo
+            offset = search.first_change()
+            self.document.swap(search.tree,offset)
+            self.highlight_change()
+            self.show_offset(offset)
+            self.status_label.text = "Replaced %d" % search.count()
+
+    def goto_match(self, step):
+
+        #step 1 goes to the next match, -1 to the one before. Matches are
+        #offsets into the text as it was, so an edit since starts over.
+        search = self.search
+        if self.document is None:
+            return
+        if search is None or search.version != self.document.version:
+            self.start_search()
+            return
+        if search.replacement is not None:
+            #A replace all only counts its matches
+            return
+        i = self.search_index + step
+        if i < 0 or i >= search.count():
+            return
+        self.search_index = i
+        start,end = search.match(i)
+        self.show_offset(start)
+        window_start = self.document.line_start(self.first_line)
+        end = min(end,window_start + len(self.window_text.encode(ENCODING)))
+        self.text_view.select_text(self.window_index(start),
+                                   self.window_index(end))
+
+    def window_index(self, offset):
+
+        #Index in the text on screen of byte offset
+        start = self.document.line_start(self.first_line)
+        return len(self.document.text(start,offset).decode(ENCODING,'replace'))
+
     def cancel_dialog(self):
         self._popup.dismiss()
         
@@ -70,10 +512,8 @@ class MainWindow(BoxLayout):
 
         if self.filepath == "":
             self.on_save_as()
-        else:
-            f = open(self.filepath,'w')
-            f.write(self.text_view.text)
-            f.close()
+        elif self.document is not None:
+            self.write_file(self.filepath)
             
     def on_save_as(self, *args):
 
@@ -85,11 +525,39 @@ class MainWindow(BoxLayout):
 
     def save_as_file(self, path,filename):
 
-        self.filepath = os.path.join(path,filename)
-        f = open(self.filepath,'w')
-        f.write(self.text_view.text)
-        f.close()        
         self.cancel_dialog()
+        if self.document is None:
+            return
+        self.filepath = os.path.join(path,filename)
+        self.write_file(self.filepath)
+        self.update_highlighter()
+        self.show_highlight()
+
+    def write_file(self, path):
+
+        #Saves a snapshot of the pieces on a worker thread, so editing can
+        #go on meanwhile. The file is renamed into place when complete,
+        #which also keeps intact a mapping of path the document reads from.
+        if self.saver is not None and not self.saver.done:
+            self.status_label.text = "Still saving"
+            return
+        self.saver = FileSaver(self.document.snapshot(),path,self.save_trigger)
+        self.document.modified = False
+        self.saver.start()
+
+    def save_progress(self, dt):
+
+        saver = self.saver
+        if saver is None:
+            return
+        if saver.error is not None:
+            self.status_label.text = "Cannot save: %s" % saver.error
+            if self.document is not None:
+                self.document.modified = True
+        elif saver.done:
+            self.status_label.text = os.path.basename(saver.path)
+        else:
+            self.status_label.text = "Saving %d%%" % (100*saver.progress())
         
     def on_copy(self, *args):
 
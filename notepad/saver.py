@@ -0,0 +1,91 @@
+import os,shutil,tempfile,threading
+
+#Saves a snapshot of a document on a worker thread. The pieces are written
+#CHUNK bytes at a time to a temporary file beside the target, which is
+#flushed to disk if sync is set and then renamed over the target, so the
+#file is always either the old version or the new one whole. notify is
+#called after each chunk and when done.
+
+CHUNK = 1 << 20
+
+class FileSaver(threading.Thread):
+
+    def __init__(self, pieces, path, notify=None, sync=True):
+
+        threading.Thread.__init__(self)
+        #Not a daemon, so that quitting waits for the save to finish
+        self.pieces = pieces
+        self.path = path
+        self.size = sum(piece[2] for piece in pieces)
+        self.written = 0
+        self.notify = notify
+        self.sync = sync
+        self.done = False
+        self.error = None
+
+    def run(self):
+
+        directory = os.path.dirname(os.path.abspath(self.path))
+        temp = None
+        try:
+            fd,temp = tempfile.mkstemp(prefix=os.path.basename(self.path) + ".",
+                                       suffix=".tmp",dir=directory)
+            with os.fdopen(fd,'wb') as f:
+                self.write(f)
+                f.flush()
+                if self.sync:
+                    os.fsync(f.fileno())
+            if os.path.exists(self.path):
+                shutil.copymode(self.path,temp)
+            os.replace(temp,self.path)
+            temp = None
+            if self.sync:
+                self.sync_directory(directory)
+        except (IOError,OSError,ValueError) as e:
+            self.error = e
+        if temp is not None:
+            try:
+                os.unlink(temp)
+            except OSError:
+                pass
+        self.done = True
+        self.publish()
+
+    def write(self, f):
+
+        for buffer,start,length in self.pieces:
+            end = start + length
+            while start < end:
+                #A slice copies, but holds no export on the buffer, which
+                #would stop the document's added bytes from growing
+                stop = min(start + CHUNK,end)
+                f.write(buffer[start:stop])
+                before = self.written // CHUNK
+                self.written += stop - start
+                start = stop
+                #Progress is published once per CHUNK written
+                if self.written // CHUNK > before:
+                    self.publish()
+
+    def sync_directory(self, directory):
+
+        #Makes the rename itself durable, where the platform allows it
+        try:
+            fd = os.open(directory,os.O_RDONLY)
+        except OSError:
+            return
+        try:
+            os.fsync(fd)
+        except OSError:
+            pass
+        finally:
+            os.close(fd)
+
+    def publish(self):
+
+        if self.notify is not None:
+            self.notify()
+
+    def progress(self):
+
+        return float(self.written) / max(self.size,1)
@@ -0,0 +1,210 @@
+import re,threading
+from loader import ENCODING
+
+#Bytes of the document searched at a time, cut back to a line end
+BLOCK = 1 << 20
+
+class DocumentSearch(threading.Thread):
+
+    #Finds pattern in a Document on a worker thread. The text is searched
+    #BLOCK bytes of whole lines at a time as one bytes object, so the
+    #scanning happens inside the regex engine, and a match cannot run from
+    #one block into the next. Matches are (start, end) byte offsets into
+    #the document as it was when the search began. Each block's are
+    #appended to matches and notify is called; done is set at the end.
+    #With a replacement, matches are only counted. In each block with any,
+    #the bytes from the first to the end of the last are rewritten into a
+    #buffer of the search's own, added to the document at the first match
+    #so that a search without any leaves none behind, and the worker builds
+    #the tree of the replaced text, for Document.swap, in tree. A piece per
+    #changed block rather than per match keeps the tree small, and the
+    #garbage collector off millions of objects.
+    def __init__(self, document, pattern, regex=False, ignore_case=True,
+                 replacement=None, notify=None):
+
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.document = document
+        #Taken here, as the tree changes with every edit
+        self.pieces = document.pieces(document.root,[])
+        self.size = len(document)
+        self.version = document.version
+        flags = re.M
+        if ignore_case:
+            flags |= re.I
+        pattern = pattern.encode(ENCODING)
+        if not regex:
+            pattern = re.escape(pattern)
+        self.pattern = re.compile(pattern,flags)
+        self.regex = regex
+        self.replacement = None
+        if replacement is not None:
+            self.replacement = replacement.encode(ENCODING)
+        self.buffer = None
+        self.notify = notify
+        self.lock = threading.Lock()
+        self.matches = []
+        self.found = 0
+        self.first = None
+        self.tree = None
+        self.cancelled = False
+        self.done = False
+        self.error = None
+
+    def run(self):
+
+        try:
+            edits = []
+            for start,text in self.blocks():
+                if self.cancelled:
+                    break
+                if self.replacement is None:
+                    hits = self.search_block(start,text)
+                    if hits:
+                        with self.lock:
+                            self.matches.extend(hits)
+                            self.found += len(hits)
+                        self.publish()
+                elif self.replace_block(start,text,edits):
+                    self.publish()
+            if edits and not self.cancelled:
+                self.build(edits)
+        except (re.error,IndexError) as e:
+            #A bad group in the replacement
+            self.error = e
+        self.done = True
+        self.publish()
+
+    def blocks(self):
+
+        #(offset, bytes) of the text in blocks that end at a newline. Long
+        #pieces, such as a whole file just opened, are read BLOCK bytes at a
+        #time rather than copied at once.
+        buffers = self.document.buffers
+        parts = []
+        size = 0
+        offset = 0
+        for buffer,start,length in self.pieces:
+            data = buffers[buffer]
+            for pos in range(start,start + length,BLOCK):
+                part = data[pos:min(pos + BLOCK,start + length)]
+                parts.append(part)
+                size += len(part)
+                if size < BLOCK:
+                    continue
+                text = b"".join(parts)
+                cut = text.rfind(b"\n") + 1
+                if cut == 0:
+                    #One line longer than a block so far
+                    parts = [text]
+                    continue
+                yield offset,text[:cut]
+                offset += cut
+                parts = [text[cut:]]
+                size = len(parts[0])
+        if size:
+            yield offset,b"".join(parts)
+
+    def finditer(self, offset, text):
+
+        #An empty match at the end of a block is left to the next, which
+        #starts there and may match more from it
+        end = len(text)
+        last = offset + end >= self.size
+        for m in self.pattern.finditer(text):
+            if m.start() == end and not last:
+                continue
+            yield m
+
+    def search_block(self, offset, text):
+
+        return [(offset + m.start(),offset + m.end())
+                for m in self.finditer(offset,text)]
+
+    def replace_block(self, offset, text, edits):
+
+        #Appends the replaced text, from the first match to the end of the
+        #last, to the buffer and an edit for it, if there are matches.
+        #Returns how many.
+        parts = []
+        lo = pos = None
+        for m in self.finditer(offset,text):
+            if lo is None:
+                lo = pos = m.start()
+            parts.append(text[pos:m.start()])
+            parts.append(m.expand(self.replacement) if self.regex
+                         else self.replacement)
+            pos = m.end()
+            if self.first is None:
+                self.first = offset + m.start()
+        count = len(parts) // 2
+        if not count:
+            return 0
+        new = b"".join(parts)
+        if self.buffer is None:
+            self.buffer = self.document.add_buffer()
+        data = self.document.buffers[self.buffer]
+        self.document.indexes[self.buffer].add_chunk(new,len(data))
+        edits.append((offset + lo,offset + pos,len(data),len(new)))
+        data.extend(new)
+        with self.lock:
+            self.found += count
+        return count
+
+    def build(self, edits):
+
+        #The pieces of the text with every (start, end, at, length) edit
+        #made, at and length placing the new bytes in this search's buffer
+        document = self.document
+        out = []
+        pos = 0
+        i = 0
+        #Document offset up to which the text has been replaced
+        skip = 0
+        for buffer,start,length in self.pieces:
+            end = pos + length
+            cur = max(pos,skip)
+            while cur < end:
+                if i < len(edits) and edits[i][0] < end:
+                    first,last,at,count = edits[i]
+                    if first > cur:
+                        out.append((buffer,start + cur - pos,first - cur))
+                    if count:
+                        out.append((self.buffer,at,count))
+                    i += 1
+                    skip = last
+                    cur = max(first,last)
+                else:
+                    out.append((buffer,start + cur - pos,end - cur))
+                    cur = end
+            pos = end
+        #Empty matches at the very end
+        for first,last,at,count in edits[i:]:
+            if count:
+                out.append((self.buffer,at,count))
+        self.tree = document.balanced(out)
+
+    def publish(self):
+
+        if self.notify is not None:
+            self.notify()
+
+    def cancel(self):
+
+        self.cancelled = True
+
+    def count(self):
+
+        with self.lock:
+            return self.found
+
+    def match(self, i):
+
+        with self.lock:
+            return self.matches[i]
+
+    def first_change(self):
+
+        if self.first is not None:
+            return self.first
+        return self.matches[0][0] if self.matches else 0
@@ -0,0 +1,76 @@
+import sys,time
+from kivy.uix.widget import Widget
+from kivy.graphics import *
+from kivy.app import App
+from clock import Ticker, hand_angles
+import clock_geometry
+
+#UTC offsets in hours, repeated to fill the requested number of clocks
+ZONES = [-10,-8,-7,-6,-5,-3,0,1,2,3,4,5.5,7,8,9,10,12]
+
+class WorldClockApp(App):
+
+    def __init__(self, offsets):
+
+        App.__init__(self)
+        self.offsets = offsets
+
+    def build(self):
+        return Dashboard(self.offsets)
+
+class Dashboard(Widget):
+
+    #All dials are drawn from a few shared Meshes per batch of clocks, and
+    #each second only the hands that moved are rewritten
+    def __init__(self, offsets, **kwargs):
+
+        super(Dashboard, self).__init__(**kwargs)
+
+        self.offsets = [o*3600 for o in offsets]
+        self.hand_meshes = []
+        self.geometry = None
+        self.bind(pos = self.rebuild)
+        self.bind(size = self.rebuild)
+        self.rebuild()
+        self.ticker = Ticker(self.update_hands)
+        self.ticker.start()
+
+    def rebuild(self, *args):
+
+        self.geometry = clock_geometry.Dashboard(len(self.offsets),
+                                                 self.width,self.height,
+                                                 self.x,self.y)
+        self.canvas.clear()
+        self.hand_meshes = []
+        with self.canvas:
+            for batch in self.geometry.batches:
+                vertices,indices = batch.major_mesh
+                Color(1,0,0)
+                Mesh(vertices=vertices,indices=indices,mode='triangles')
+                vertices,indices = batch.minor_mesh
+                Color(0,1,0)
+                Mesh(vertices=vertices,indices=indices,mode='triangles')
+                Color(0.7,0.5,0.4)
+                self.hand_meshes.append(Mesh(vertices=batch.hand_vertices,
+                                             indices=batch.hand_indices,
+                                             mode='triangles'))
+        self.update_hands()
+
+    def update_hands(self, t=None):
+
+        if t is None:
+            t = time.time()
+        angles = [hand_angles(t + offset,convert=time.gmtime)
+                  for offset in self.offsets]
+        for b in self.geometry.update(angles):
+            self.hand_meshes[b].vertices = self.geometry.batches[b].hand_vertices
+
+if __name__ == '__main__':
+
+    count = len(ZONES)
+    if len(sys.argv) > 1:
+        count = int(sys.argv[1])
+        if count < 1:
+            sys.exit("need at least one clock")
+    offsets = [ZONES[i%len(ZONES)] for i in range(0,count)]
+    WorldClockApp(offsets).run()
@@ -0,0 +1,37 @@
+import math,time
+import clock_geometry
+
+#Times the CPU side of one dashboard frame: computing the angles of every
+#clock and rewriting the hands that moved. Runs without Kivy.
+
+def angles_at(t, offsets):
+
+    angles = []
+    for offset in offsets:
+        lt = time.gmtime(t + offset)
+        angles.append((math.radians(lt.tm_sec*6),math.radians(lt.tm_min*6),
+                       math.radians((lt.tm_hour%12)*30)))
+    return angles
+
+def bench(count, seconds=120):
+
+    if count < 1:
+        raise ValueError("need at least one clock")
+    offsets = [(i%24)*3600 for i in range(0,count)]
+    start = time.time()
+    dashboard = clock_geometry.Dashboard(count,1920,1080)
+    build = time.time() - start
+    dashboard.update(angles_at(0,offsets))
+
+    start = time.time()
+    for s in range(1,seconds + 1):
+        dashboard.update(angles_at(s,offsets))
+    frame = (time.time() - start)/seconds
+    return build,frame,len(dashboard.batches)*3
+
+if __name__ == '__main__':
+
+    print("%8s %10s %10s %8s" % ("clocks","build ms","frame ms","meshes"))
+    for count in (1,10,50,100,200,500,1000):
+        build,frame,meshes = bench(count)
+        print("%8d %10.2f %10.3f %8d" % (count,build*1e3,frame*1e3,meshes))